@@ -0,0 +1,184 @@
+import itertools
+from collections import namedtuple
+
+
+class EStep:
+    FLUSH = 0
+    POUR = 1
+    # liquid still travelling down the line after its pump stopped, no pump runs
+    TRANSIT = 2
+
+
+# flush_before / flush_after : flush durations around the pour, 0 skips the flush
+# line_delay : how long the liquid takes to reach the cup, the line can only be flushed once it landed
+Pour = namedtuple("Pour", ("module", "pour_time", "line_delay", "flush_before", "flush_after"))
+
+
+class Step:
+    def __init__(self, module, kind, duration):
+        self.module = module
+        self.kind = kind
+        self.duration = duration
+        self.start = 0
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+    @property
+    def uses_pump(self):
+        return self.kind != EStep.TRANSIT
+
+    def to_dict(self):
+        return {"module": self.module, "kind": self.kind, "start": self.start, "end": self.end}
+
+    def __repr__(self):
+        kind = {EStep.FLUSH: "flush", EStep.POUR: "pour", EStep.TRANSIT: "transit"}[self.kind]
+        return f"Step({self.module}, {kind}, {self.start:.2f}->{self.end:.2f})"
+
+
+class BlendScheduler:
+    # every flush or pour step keeps exactly one pump running on its module, transit steps none
+    # all of it is deterministic : same pours and settings, same plan
+
+    # above that many ingredients, the pour orders tried are heuristics instead of every permutation
+    MAX_EXHAUSTIVE = 5
+
+    def __init__(self, max_concurrent_pumps):
+        self.max_concurrent_pumps = max(1, int(max_concurrent_pumps))
+
+    def make_chains(self, pours):
+        # pours : list of Pour, in priority order
+        chains = []
+        for pour in pours:
+            chain = []
+            if pour.flush_before > 0:
+                chain.append(Step(pour.module, EStep.FLUSH, pour.flush_before))
+            if pour.pour_time > 0:
+                chain.append(Step(pour.module, EStep.POUR, pour.pour_time))
+                if pour.line_delay > 0:
+                    chain.append(Step(pour.module, EStep.TRANSIT, pour.line_delay))
+            if pour.flush_after > 0:
+                chain.append(Step(pour.module, EStep.FLUSH, pour.flush_after))
+            chains.append(chain)
+        return chains
+
+    def schedule(self, pours):
+        # list scheduling of the chains, in the given priority order
+        chains = self.make_chains(pours)
+        steps = []
+
+        # earliest time the next step of each chain may start
+        ready_at = [0 for _ in chains]
+        next_index = [0 for _ in chains]
+        running = []
+        now = 0
+
+        while True:
+            running = [s for s in running if s.end > now]
+            free = self.max_concurrent_pumps - len(running)
+
+            for i, chain in enumerate(chains):
+                if next_index[i] >= len(chain) or ready_at[i] > now:
+                    continue
+                step = chain[next_index[i]]
+                if step.uses_pump:
+                    if free <= 0:
+                        continue
+                    running.append(step)
+                    free -= 1
+                step.start = now
+                next_index[i] += 1
+                ready_at[i] = step.end
+                steps.append(step)
+
+            if all(next_index[i] >= len(chain) for i, chain in enumerate(chains)):
+                break
+
+            # jump to the next instant where a pump is released or a chain becomes ready
+            candidates = [s.end for s in running]
+            candidates += [ready_at[i] for i, chain in enumerate(chains) if next_index[i] < len(chain) and ready_at[i] > now]
+            now = min(candidates)
+
+        return steps
+
+    def candidate_orders(self, pours):
+        if len(pours) <= self.MAX_EXHAUSTIVE:
+            return itertools.permutations(pours)
+        # longest line delay first : its transit frees the pump while the liquid travels
+        # longest chain first : the classic longest processing time rule
+        orders = [
+            list(pours),
+            sorted(pours, key=lambda p: (-p.line_delay, -p.pour_time, p.module)),
+            sorted(pours, key=lambda p: (-(p.flush_before + p.pour_time + p.line_delay + p.flush_after), p.module)),
+            sorted(pours, key=lambda p: (-p.pour_time, p.module)),
+        ]
+        return orders
+
+    def optimize(self, pours):
+        # tries pour orders and keeps the one that finishes first, ties keep the earliest order tried
+        pours = list(pours)
+        if len(pours) <= self.max_concurrent_pumps:
+            # every chain starts right away, the order can't change anything
+            return self.schedule(pours)
+
+        def cost(order):
+            steps = self.schedule(order)
+            return self.total_time(steps), steps
+
+        best_order, (best_time, best) = None, (None, None)
+        for order in self.candidate_orders(pours):
+            total, steps = cost(order)
+            if best is None or total < best_time - 1e-9:
+                best_order, best_time, best = list(order), total, steps
+
+        if len(pours) > self.MAX_EXHAUSTIVE:
+            # too many permutations, improve the best heuristic by swapping pairs while it helps
+            improved = True
+            while improved:
+                improved = False
+                for i, j in itertools.combinations(range(len(best_order)), 2):
+                    order = list(best_order)
+                    order[i], order[j] = order[j], order[i]
+                    total, steps = cost(order)
+                    if total < best_time - 1e-9:
+                        best_order, best_time, best = order, total, steps
+                        improved = True
+        return best
+
+    def fill(self, steps, pours, deadline):
+        # places the chains of extra pours in the pumps left idle by steps, without moving any of them,
+        # a chain that can't be done by deadline is left out
+        placed = []
+        for chain in self.make_chains(pours):
+            busy = [s for s in steps + placed if s.uses_pump]
+            after = 0
+            for step in chain:
+                start = self.earliest_start(busy, step, after, deadline)
+                if start is None:
+                    break
+                step.start = start
+                if step.uses_pump:
+                    busy.append(step)
+                after = step.end
+            else:
+                placed += chain
+        return placed
+
+    def earliest_start(self, busy, step, after, deadline):
+        if not step.uses_pump:
+            return after if after + step.duration <= deadline + 1e-9 else None
+        # a pump is only released when a step ends, those are the only instants worth trying
+        for start in sorted({after} | {s.end for s in busy if s.end > after}):
+            end = start + step.duration
+            if end > deadline + 1e-9:
+                return None
+            # the number of running pumps only goes up when one of the busy steps starts
+            instants = [start] + [s.start for s in busy if start < s.start < end]
+            if all(sum(1 for s in busy if s.start <= t < s.end) < self.max_concurrent_pumps for t in instants):
+                return start
+        return None
+
+    @staticmethod
+    def total_time(steps):
+        return max((s.end for s in steps), default=0)
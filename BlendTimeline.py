@@ -0,0 +1,96 @@
+import time
+
+
+class Timeline:
+    # register changes as (offset, (on_mask, off_mask)), offset in seconds from the start of the blend
+    def __init__(self, changes, total_time):
+        self.changes = changes
+        self.total_time = total_time
+
+    @classmethod
+    def compile(cls, entries, total_time=0):
+        # entries : iterable of (offset, bit, on)
+        # a bit switched off and on at the same offset stays on
+        # total_time : the timeline lasts at least that long, even if nothing changes at the end (liquid still in the lines)
+        by_offset = {}
+        for offset, bit, on in entries:
+            on_mask, off_mask = by_offset.get(offset, (0, 0))
+            if on:
+                on_mask |= 1 << bit
+            else:
+                off_mask |= 1 << bit
+            by_offset[offset] = (on_mask, off_mask)
+
+        changes = [(offset, (by_offset[offset][0], by_offset[offset][1] & ~by_offset[offset][0])) for offset in sorted(by_offset)]
+        total_time = max(changes[-1][0] if changes else 0, total_time)
+        return cls(changes, total_time)
+
+    @property
+    def on_mask(self):
+        # every bit the timeline switches on at some point
+        mask = 0
+        for _, (on_mask, _) in self.changes:
+            mask |= on_mask
+        return mask
+
+    def __len__(self):
+        return len(self.changes)
+
+
+class TimelineExecutor:
+    # applies a timeline against absolute monotonic deadlines, so sleep and latch overhead never add up
+    def __init__(self, apply, status_period=1.0, spin_margin=0.002):
+        self.apply = apply
+        self.status_period = status_period
+        self.spin_margin = spin_margin
+
+        # how long apply() takes, changes are fired that much earlier to land on time
+        self.apply_latency = 0
+        self.max_lateness = 0
+
+    def wait_until(self, deadline, start, on_progress):
+        while True:
+            now = time.monotonic()
+            remaining = deadline - now
+            if remaining <= 0:
+                return now
+            if now >= self.next_status:
+                on_progress(now - start)
+                self.next_status += self.status_period
+                continue
+            sleep_for = min(remaining - self.spin_margin, self.next_status - now)
+            # the last couple of milliseconds are yielded instead of slept, sleep overshoots
+            time.sleep(sleep_for if sleep_for > 0 else 0)
+
+    def run(self, timeline, on_progress):
+        start = time.monotonic()
+        self.next_status = start
+        self.max_lateness = 0
+
+        for offset, changes in timeline.changes:
+            deadline = start + offset
+            self.wait_until(deadline - self.apply_latency, start, on_progress)
+
+            before = time.monotonic()
+            self.apply(changes)
+            after = time.monotonic()
+
+            self.apply_latency = 0.8 * self.apply_latency + 0.2 * (after - before)
+            self.max_lateness = max(self.max_lateness, after - deadline)
+
+        self.wait_until(start + timeline.total_time, start, on_progress)
+        on_progress(timeline.total_time)
+        return time.monotonic() - start
+
+
+class BlendPlan:
+    # everything a timed blend needs once planned : the schedule, its compiled timeline and the pump time of each module
+    def __init__(self, steps, timeline, pump_times, key=None, pours=None):
+        self.steps = steps
+        # the Pour list (pump times, line delays, flush durations) it was scheduled from
+        self.pours = pours
+        self.timeline = timeline
+        self.total_time = timeline.total_time
+        self.pump_times = pump_times
+        # config values the plan was computed from, see ModulesController.plan_key
+        self.key = key
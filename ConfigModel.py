@@ -0,0 +1,160 @@
+import json
+from types import MappingProxyType
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class PumpConfig:
+    __slots__ = ("enabled", "delay_for_distance", "speed_ratio", "calibration", "flush_time", "liquid")
+
+    def __init__(self, enabled=True, delay_for_distance=0, speed_ratio=1.0, calibration=None, flush_time=None, liquid=None):
+        self.enabled = bool(enabled)
+        self.delay_for_distance = delay_for_distance
+        self.speed_ratio = float(speed_ratio)
+        self.calibration = calibration
+        # None : the global flush_time
+        self.flush_time = None if flush_time is None else float(flush_time)
+        # what the bottle holds, a line primed with another liquid is always flushed
+        self.liquid = liquid
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("enabled", True), data.get("delay_for_distance", 0), data.get("speed_ratio", 1.0), data.get("calibration"),
+                   data.get("flush_time"), data.get("liquid"))
+
+    def to_dict(self):
+        data = {"enabled": self.enabled, "delay_for_distance": self.delay_for_distance, "speed_ratio": self.speed_ratio}
+        if self.calibration is not None:
+            data["calibration"] = dict(self.calibration)
+        if self.flush_time is not None:
+            data["flush_time"] = self.flush_time
+        if self.liquid is not None:
+            data["liquid"] = self.liquid
+        return data
+
+
+class WeightCellConfig:
+    __slots__ = ("offset", "reference_unit")
+
+    def __init__(self, offset=0, reference_unit=1):
+        self.offset = offset
+        self.reference_unit = reference_unit
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("offset", 0), data.get("reference_unit", 1))
+
+    def to_dict(self):
+        return {"offset": self.offset, "reference_unit": self.reference_unit}
+
+
+class GlobalConfig:
+    # name : (type, default)
+    FIELDS = {
+        "nb_modules": (int, 8),
+        "sec_per_liter": (float, 90),
+        "flush_time": (float, 3),
+        "flush_clean_validity": (float, 600),
+        "flush_primed_validity": (float, 300),
+        "flush_rinse_ratio": (float, 0.5),
+        "flush_keep_primed": (bool, False),
+        "order_pipelining": (bool, True),
+        "max_concurrent_pumps": (int, 4),
+        "cup_swap_timeout": (float, 120),
+        "sampler_enabled": (bool, True),
+        "sampler_period": (float, 1.0),
+        "sampler_buffer_size": (int, 32),
+        "sampler_samples": (int, 3),
+        "dosing_mode": (str, "timed"),
+        "dosing_latency": (float, 0.15),
+        "liquid_density": (float, 1000),
+        "weight_tolerance": (float, 0.5),
+        "weight_min_samples": (int, 3),
+        "weight_max_samples": (int, 10),
+        "zero_tracking_enabled": (bool, True),
+        "zero_tracking_stable_time": (float, 30),
+        "zero_tracking_band": (float, 0.5),
+        "zero_tracking_max_drift": (float, 5),
+        "zero_tracking_max_step": (float, 0.5),
+        "weight_filter": (str, "median"),
+        "weight_filter_window": (int, 5),
+        "weight_filter_alpha": (float, 0.3),
+        "weight_filter_process_noise": (float, 0.01),
+        "weight_filter_measurement_noise": (float, 0.25),
+        "weight_outlier_threshold": (float, 50),
+        "weight_outlier_max_rejects": (int, 3),
+    }
+    __slots__ = tuple(FIELDS.keys())
+
+    def __init__(self, **values):
+        for name, (_type, default) in self.FIELDS.items():
+            self.set(name, values.get(name, default))
+
+    def set(self, name, value):
+        _type, _ = self.FIELDS[name]
+        setattr(self, name, _type(value))
+
+    def get(self, name):
+        return getattr(self, name)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{k: v for k, v in data.items() if k in cls.FIELDS})
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+class Config:
+    __slots__ = ("pumps", "weight_cells", "globals")
+
+    def __init__(self, pumps=None, weight_cells=None, globals_config=None):
+        self.pumps = pumps or []
+        self.weight_cells = weight_cells or []
+        self.globals = globals_config or GlobalConfig()
+
+    @classmethod
+    def from_dict(cls, data):
+        config = cls(
+            [PumpConfig.from_dict(p) for p in data.get("pumps", [])],
+            [WeightCellConfig.from_dict(w) for w in data.get("weight_cells", [])],
+            GlobalConfig.from_dict(data),
+        )
+        config.resize(config.globals.nb_modules)
+        return config
+
+    def resize(self, nb_modules):
+        # modules missing from the file get default settings, extra entries are dropped
+        self.globals.set("nb_modules", nb_modules)
+        self.pumps = self.pumps[:nb_modules] + [PumpConfig() for _ in range(nb_modules - len(self.pumps))]
+        self.weight_cells = self.weight_cells[:nb_modules] + [WeightCellConfig() for _ in range(nb_modules - len(self.weight_cells))]
+
+    def to_dict(self):
+        data = {
+            "pumps": [p.to_dict() for p in self.pumps],
+            "weight_cells": [w.to_dict() for w in self.weight_cells],
+        }
+        data.update(self.globals.to_dict())
+        return data
+
+
+class ConfigSnapshot:
+    # read only view of the config at a given version, serialized once and shared by every reader
+    __slots__ = ("version", "data", "_json")
+
+    def __init__(self, version, data):
+        self.version = version
+        self._json = {
+            None: json.dumps(data),
+            "pumps": json.dumps(data["pumps"]),
+        }
+        self.data = freeze(data)
+
+    def to_json(self, key=None):
+        return self._json[key]
@@ -0,0 +1,120 @@
+import time
+
+from HX711_2 import HX711TimeoutError
+from StatesManager import StatesManager
+
+
+class EDosing:
+    TIMED = "timed"
+    GRAVIMETRIC = "gravimetric"
+
+
+class GravimetricDoser:
+    # runs a main pump while watching its bottle weight cell, and stops on the dispensed mass
+    def __init__(self, controller, flow_window=10, max_jump=10, max_rejects=3, max_rebaselines=2, time_margin=0.2):
+        self.controller = controller
+        self.flow_window = flow_window
+        # a sample moving more than this (grams) from the previous one is a glitch
+        self.max_jump = max_jump
+        # that many glitches in a row are a real step of the bottle weight (knocked, moved), the baseline follows it
+        self.max_rejects = max_rejects
+        # more steps than that in one pour and the weights are not trusted anymore, the pour ends on time
+        self.max_rebaselines = max_rebaselines
+        # the pump never runs longer than the timed pour time plus that share of it
+        self.time_margin = time_margin
+
+    def is_available(self, module):
+        sm = StatesManager()
+        return sm.get_pump_enabled(module) and sm.get_weight_cell_offset(module) != 0
+
+    @staticmethod
+    def flow_rate(samples):
+        # least squares slope of (time, dispensed mass), in grams per second
+        n = len(samples)
+        if n < 2:
+            return 0
+        mean_t = sum(t for t, _ in samples) / n
+        mean_m = sum(m for _, m in samples) / n
+        var_t = sum((t - mean_t) ** 2 for t, _ in samples)
+        if var_t == 0:
+            return 0
+        return sum((t - mean_t) * (m - mean_m) for t, m in samples) / var_t
+
+    def dose(self, module, quantity):
+        # returns (dispensed grams, pump seconds), or None when the cell can't be used
+        sm = StatesManager()
+        target = quantity * sm.get_liquid_density()
+        latency = sm.get_dosing_latency()
+        timed_time = self.controller.get_pump_time(module, quantity)
+        max_time = timed_time * (1 + self.time_margin) + latency
+
+        cells = self.controller.weight_cells
+        # (timestamp, weight) handed to the sampler once the pump is off, its listeners must not slow the loop down
+        published = []
+        with cells.lock:
+            try:
+                start_weight = cells.read(module, 3)
+            except HX711TimeoutError:
+                return None
+
+            self.controller.set_main_pump_state(module, on=True)
+            self.controller.send_states()
+            start = time.monotonic()
+
+            samples = []
+            dispensed = 0
+            last_accepted = 0
+            rejected = 0
+            rebaselines = 0
+            timed = False
+            try:
+                try:
+                    while True:
+                        weight = cells.read(module, 1)
+                        now = time.monotonic() - start
+                        if now >= max_time:
+                            break
+                        measured = start_weight - weight
+                        if abs(measured - dispensed) > self.max_jump:
+                            rejected += 1
+                            if rejected < self.max_rejects:
+                                continue
+                            rebaselines += 1
+                            if rebaselines > self.max_rebaselines:
+                                print(f"dose {module} : weight keeps jumping, finishing on time")
+                                timed = True
+                                break
+                            # the liquid kept flowing while the samples were rejected, the new baseline accounts for it
+                            dispensed += max(0, self.flow_rate(samples)) * (now - last_accepted)
+                            start_weight = weight + dispensed
+                            measured = dispensed
+                        rejected = 0
+                        dispensed = measured
+                        last_accepted = now
+                        published.append((time.time(), weight))
+
+                        samples.append((now, dispensed))
+                        samples = samples[-self.flow_window:]
+
+                        # the weight stream lags behind the pump (conversion time, line inertia), stop early by that much
+                        predicted = dispensed + max(0, self.flow_rate(samples)) * latency
+                        if predicted >= target:
+                            break
+                except HX711TimeoutError:
+                    # lost the cell mid pour, the remaining part is poured on time
+                    print(f"dose {module} : weight cell lost, finishing on time")
+                    timed = True
+                if timed:
+                    remaining = max(0, 1 - dispensed / target) if target > 0 else 0
+                    time.sleep(max(0, min(timed_time * remaining, max_time - (time.monotonic() - start))))
+                    # what the timed part is expected to have brought it to
+                    dispensed = max(dispensed, target)
+            finally:
+                self.controller.set_main_pump_state(module, on=False)
+                self.controller.send_states()
+
+            pump_time = time.monotonic() - start
+
+        for timestamp, weight in published:
+            self.controller.weight_sampler.record(module, weight, timestamp)
+        return dispensed, pump_time
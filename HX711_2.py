@@ -1,13 +1,21 @@
 # source : https://github.com/tatobari/hx711py/blob/master/hx711.py
 
-import RPi.GPIO as GPIO
 import time
 import threading
 
+from Hardware import get_backend
+
+
+class HX711TimeoutError(TimeoutError):
+    pass
+
 
 class HX711:
 
-    def __init__(self, dout, pd_sck, gain=128):
+    def __init__(self, dout, pd_sck, gain=128, gpio=None, settle_time=1):
+        # RPi.GPIO or any object exposing the same api (see Hardware.py)
+        self.GPIO = gpio if gpio is not None else get_backend().gpio
+
         self.PD_SCK = pd_sck
 
         self.DOUT = dout
@@ -16,9 +24,9 @@ class HX711:
         # software try to access get values from the class at the same time.
         self.readLock = threading.Lock()
 
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.PD_SCK, GPIO.OUT)
-        GPIO.setup(self.DOUT, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        self.GPIO.setmode(self.GPIO.BCM)
+        self.GPIO.setup(self.PD_SCK, self.GPIO.OUT)
+        self.GPIO.setup(self.DOUT, self.GPIO.IN, pull_up_down=self.GPIO.PUD_DOWN)
 
         self.GAIN = 0
 
@@ -33,19 +41,42 @@ class HX711:
 
         self.DEBUG_PRINTING = False
 
+        # Max time to wait for DOUT to go low before giving up on a sample.
+        # At 10 SPS a conversion takes 100ms, and 400ms after a power up.
+        self.READ_TIMEOUT = 1.0
+        self.POLL_MIN_INTERVAL = 0.0005
+        self.POLL_MAX_INTERVAL = 0.01
+
         self.byte_format = 'MSB'
         self.bit_format = 'MSB'
 
         self.set_gain(gain)
 
         # Think about whether this is necessary.
-        time.sleep(1)
+        # Callers that handle settling themselves (WeightCellsPool) pass 0.
+        time.sleep(settle_time)
 
     def convertFromTwosComplement24bit(self, inputValue):
         return -(inputValue & 0x800000) + (inputValue & 0x7fffff)
 
     def is_ready(self):
-        return GPIO.input(self.DOUT) == 0
+        return self.GPIO.input(self.DOUT) == 0
+
+    def wait_ready(self, timeout=None):
+        # Sleep-poll DOUT with an exponential back-off instead of spinning, so
+        # the CPU stays free while the conversion runs. DOUT stays low until
+        # the sample is clocked out, so a late poll never misses a sample.
+        if timeout is None:
+            timeout = self.READ_TIMEOUT
+        deadline = time.monotonic() + timeout
+        interval = self.POLL_MIN_INTERVAL
+
+        while not self.is_ready():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise HX711TimeoutError("HX711::wait_ready(): DOUT did not go low within %.3fs, is the cell plugged and powered?" % timeout)
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, self.POLL_MAX_INTERVAL)
 
     def set_gain(self, gain):
         if gain == 128:
@@ -55,7 +86,7 @@ class HX711:
         elif gain == 32:
             self.GAIN = 2
 
-        GPIO.output(self.PD_SCK, False)
+        self.GPIO.output(self.PD_SCK, False)
 
         # Read out a set of raw bytes and throw it away.
         self.readRawBytes()
@@ -75,9 +106,9 @@ class HX711:
         # Clock HX711 Digital Serial Clock (PD_SCK).  DOUT will be
         # ready 1us after PD_SCK rising edge, so we sample after
         # lowering PD_SCL, when we know DOUT will be stable.
-        GPIO.output(self.PD_SCK, True)
-        GPIO.output(self.PD_SCK, False)
-        value = GPIO.input(self.DOUT)
+        self.GPIO.output(self.PD_SCK, True)
+        self.GPIO.output(self.PD_SCK, False)
+        value = self.GPIO.input(self.DOUT)
 
         # Convert Boolean to int and return it.
         return int(value)
@@ -103,24 +134,25 @@ class HX711:
         # driving the HX711 serial interface.
         self.readLock.acquire()
 
-        # Wait until HX711 is ready for us to read a sample.
-        while not self.is_ready():
-            pass
-
-        # Read three bytes of data from the HX711.
-        firstByte = self.readNextByte()
-        secondByte = self.readNextByte()
-        thirdByte = self.readNextByte()
-
-        # HX711 Channel and gain factor are set by number of bits read
-        # after 24 data bits.
-        for i in range(self.GAIN):
-            # Clock a bit out of the HX711 and throw it away.
-            self.readNextBit()
-
-        # Release the Read Lock, now that we've finished driving the HX711
-        # serial interface.
-        self.readLock.release()
+        try:
+            # Wait until HX711 is ready for us to read a sample, raises
+            # HX711TimeoutError if it never gets ready.
+            self.wait_ready()
+
+            # Read three bytes of data from the HX711.
+            firstByte = self.readNextByte()
+            secondByte = self.readNextByte()
+            thirdByte = self.readNextByte()
+
+            # HX711 Channel and gain factor are set by number of bits read
+            # after 24 data bits.
+            for i in range(self.GAIN):
+                # Clock a bit out of the HX711 and throw it away.
+                self.readNextBit()
+        finally:
+            # Release the Read Lock, now that we've finished driving the HX711
+            # serial interface.
+            self.readLock.release()
 
         # Depending on how we're configured, return an ordered list of raw byte
         # values.
@@ -200,8 +232,6 @@ class HX711:
         for x in range(times):
             valueList += [self.read_long()]
 
-        print(valueList)
-
         valueList.sort()
 
         # If times is odd we can just take the centre value.
@@ -209,13 +239,10 @@ class HX711:
             return valueList[len(valueList) // 2]
         else:
             # If times is even we have to take the arithmetic mean of
-            # the two middle values.
-            valueList = list(filter(lambda x: x > 0, valueList))
-            midpoint = int(len(valueList) / 2)
-            v = sum(valueList[midpoint-1:midpoint + 1]) / 2.0
-            print(valueList[midpoint-1:midpoint + 1])
-            print(v)
-            return v
+            # the two middle values. Negative values are legitimate
+            # readings (below the tare point) and are kept.
+            midpoint = len(valueList) // 2
+            return sum(valueList[midpoint-1:midpoint + 1]) / 2.0
 
     # Compatibility function, uses channel A version
     def get_value(self, times=3):
@@ -357,8 +384,8 @@ class HX711:
         # Because a rising edge on HX711 Digital Serial Clock (PD_SCK).  We then
         # leave it held up and wait 100us.  After 60us the HX711 should be
         # powered down.
-        GPIO.output(self.PD_SCK, False)
-        GPIO.output(self.PD_SCK, True)
+        self.GPIO.output(self.PD_SCK, False)
+        self.GPIO.output(self.PD_SCK, True)
 
         time.sleep(0.0001)
 
@@ -372,7 +399,7 @@ class HX711:
         self.readLock.acquire()
 
         # Lower the HX711 Digital Serial Clock (PD_SCK) line.
-        GPIO.output(self.PD_SCK, False)
+        self.GPIO.output(self.PD_SCK, False)
 
         # Wait 100 us for the HX711 to power back up.
         time.sleep(0.0001)
@@ -393,12 +420,12 @@ class HX711:
         self.power_up()
 
     def stop(self):
-        GPIO.setup(self.PD_SCK, GPIO.OUT)
-        GPIO.output(self.PD_SCK, GPIO.LOW)
-        GPIO.setup(self.DOUT, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        self.GPIO.setup(self.PD_SCK, self.GPIO.OUT)
+        self.GPIO.output(self.PD_SCK, self.GPIO.LOW)
+        self.GPIO.setup(self.DOUT, self.GPIO.IN, pull_up_down=self.GPIO.PUD_DOWN)
 
     def read_dout_state(self):
-        return GPIO.input(self.DOUT)
+        return self.GPIO.input(self.DOUT)
 
 
 # EOF - hx711.py
@@ -0,0 +1,299 @@
+import os
+import random
+import threading
+import time
+
+
+# "rpi" drives the real GPIO / 74HC595 / neopixel, "sim" runs everything in memory
+BACKEND_ENV = "GIBOTRON_BACKEND"
+
+# must match ModulesController.EComponent, kept here to avoid a circular import
+SIM_BITS = 8
+SIM_MAIN_PUMP = 2
+SIM_WEIGHT_CELL = 4
+
+
+# byte -> its 8 bits, most significant first
+BYTE_BITS = [tuple(bool(byte >> (7 - i) & 1) for i in range(8)) for byte in range(256)]
+
+
+def bytes_to_bits(data):
+    bits = []
+    for byte in data:
+        bits.extend(BYTE_BITS[byte])
+    return bits
+
+
+# region raspberry
+class ByteShiftRegister:
+    # lets pi74HC595 be fed whole bytes, expanded through a lookup table instead of bit by bit
+    def __init__(self, register):
+        self.register = register
+
+    def set_by_bytes(self, data):
+        self.register.set_by_list(bytes_to_bits(data))
+
+    def set_by_list(self, values):
+        self.register.set_by_list(values)
+
+    def clear(self):
+        self.register.clear()
+
+
+class RaspberryBackend:
+    name = "rpi"
+
+    def __init__(self):
+        import RPi.GPIO as gpio
+        self.gpio = gpio
+
+    def shift_register(self, data_pin, latch_pin, clock_pin, nb_registers):
+        from pi74HC595 import pi74HC595
+        return ByteShiftRegister(pi74HC595(data_pin, latch_pin, clock_pin, nb_registers))
+
+    def led_strip(self, pin, nb_leds, brightness):
+        import neopixel
+        import board
+        return neopixel.NeoPixel(getattr(board, f"D{pin}"), nb_leds, brightness=brightness, auto_write=False, pixel_order=neopixel.GRB)
+
+    def attach_hx711(self, dout_pin, sck_pin):
+        pass
+# endregion
+
+
+# region simulation
+class SimulatedCell:
+    def __init__(self, weight, flow_rate, offset=120000, reference_unit=203, noise=40):
+        # weight in grams, flow_rate in grams per second of main pump
+        self.weight = weight
+        self.flow_rate = flow_rate
+        self.offset = offset
+        self.reference_unit = reference_unit
+        self.noise = noise
+        self.plugged = True
+
+    def raw_value(self):
+        value = self.offset + self.weight * self.reference_unit + random.gauss(0, self.noise)
+        return int(max(-0x800000, min(0x7fffff, value)))
+
+
+class SimulatedWorld:
+    def __init__(self, nb_modules=8, samples_per_second=10, settle_time=0.05):
+        self.lock = threading.RLock()
+        self.nb_modules = nb_modules
+        self.cells = [SimulatedCell(1000.0, 1000 / 90) for _ in range(nb_modules)]
+        self.image = [False for _ in range(nb_modules * SIM_BITS)]
+        self.latch_count = 0
+        self.last_update = time.monotonic()
+
+        # hx711 bus
+        self.dout_pin = None
+        self.sck_pin = None
+        self.conversion_time = 1 / samples_per_second
+        self.settle_time = settle_time
+        self.selected = None
+        self.selected_at = 0
+        self.conversion_start = 0
+        self.sck_high_at = None
+        self.shift_bits = None
+        self.pulses = 0
+        self.conversions = 0
+
+    def resize(self, nb_modules):
+        with self.lock:
+            self.cells = self.cells[:nb_modules] + [SimulatedCell(1000.0, 1000 / 90) for _ in range(nb_modules - len(self.cells))]
+            self.image = [False for _ in range(nb_modules * SIM_BITS)]
+            self.nb_modules = nb_modules
+            self.selected = None
+
+    def update(self):
+        now = time.monotonic()
+        with self.lock:
+            dt = now - self.last_update
+            self.last_update = now
+            for module, cell in enumerate(self.cells):
+                if self.image[module * SIM_BITS + SIM_MAIN_PUMP]:
+                    cell.weight = max(0.0, cell.weight - cell.flow_rate * dt)
+
+    def set_register(self, image):
+        self.update()
+        with self.lock:
+            self.image = list(image)
+            self.latch_count += 1
+            selected = None
+            for module in range(self.nb_modules):
+                if self.image[module * SIM_BITS + SIM_WEIGHT_CELL]:
+                    selected = module
+                    break
+            if selected != self.selected:
+                self.selected = selected
+                self.reset_conversion(time.monotonic())
+
+    # region hx711
+    def reset_conversion(self, now):
+        # a freshly powered (or reset) hx711 needs to settle before its first conversion
+        self.selected_at = now
+        self.conversion_start = now
+        self.shift_bits = None
+        self.pulses = 0
+
+    def is_converted(self):
+        if self.selected is None or not self.cells[self.selected].plugged:
+            return False
+        now = time.monotonic()
+        if now - self.selected_at < self.settle_time:
+            return False
+        return now - self.conversion_start >= self.conversion_time
+
+    def dout(self):
+        with self.lock:
+            if self.shift_bits is not None:
+                return self.shift_bits[self.pulses - 1] if self.pulses > 0 else 0
+            return 0 if self.is_converted() else 1
+
+    def sck(self, value):
+        now = time.monotonic()
+        with self.lock:
+            if value:
+                self.sck_high_at = now
+                if self.shift_bits is not None:
+                    if self.pulses < 24:
+                        self.pulses += 1
+                    else:
+                        # gain pulse : DOUT goes high until the next conversion is done
+                        self.shift_bits = None
+                        self.pulses = 0
+                        self.conversion_start = now
+                        self.conversions += 1
+                elif self.is_converted():
+                    self.update()
+                    raw = self.cells[self.selected].raw_value() & 0xffffff
+                    self.shift_bits = [(raw >> (23 - i)) & 1 for i in range(24)]
+                    self.pulses = 1
+            else:
+                if self.sck_high_at is not None and now - self.sck_high_at > 90e-6 and self.pulses <= 1:
+                    # PD_SCK held high for more than 60us powered the chip down, lowering it resets.
+                    # Only checked outside of a read, python jitter would otherwise reset mid sample
+                    self.reset_conversion(now)
+                self.sck_high_at = None
+    # endregion
+
+
+class SimulatedGPIO:
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+
+    def __init__(self, world):
+        self.world = world
+        self.mode = None
+        self.pins = {}
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        self.pins[pin] = self.LOW if initial is None else initial
+
+    def output(self, pin, value):
+        value = self.HIGH if value else self.LOW
+        self.pins[pin] = value
+        if pin == self.world.sck_pin:
+            self.world.sck(value)
+
+    def input(self, pin):
+        if pin == self.world.dout_pin:
+            return self.world.dout()
+        return self.pins.get(pin, self.LOW)
+
+    def cleanup(self, pin=None):
+        if pin is None:
+            self.pins.clear()
+        else:
+            self.pins.pop(pin, None)
+
+
+class SimulatedShiftRegister:
+    def __init__(self, world, nb_registers):
+        self.world = world
+        self.nb_registers = nb_registers
+        # one simulated module per register in the chain
+        self.world.resize(nb_registers)
+
+    def set_by_list(self, values):
+        # the last bit shifted is bit 0 of module 0
+        self.world.set_register(values[::-1])
+
+    def set_by_bytes(self, data):
+        self.set_by_list(bytes_to_bits(data))
+
+    def clear(self):
+        self.world.set_register([False for _ in range(self.nb_registers * SIM_BITS)])
+
+
+class SimulatedLedStrip:
+    def __init__(self, nb_leds, brightness):
+        self.pixels = [(0, 0, 0) for _ in range(nb_leds)]
+        self.brightness = brightness
+        self.shown = list(self.pixels)
+
+    def fill(self, color):
+        self.pixels = [color for _ in self.pixels]
+
+    def __setitem__(self, index, color):
+        self.pixels[index] = color
+
+    def __getitem__(self, index):
+        return self.pixels[index]
+
+    def show(self):
+        self.shown = list(self.pixels)
+
+
+class SimulatedBackend:
+    name = "sim"
+
+    def __init__(self, nb_modules=8, samples_per_second=80):
+        self.world = SimulatedWorld(nb_modules, samples_per_second)
+        self.gpio = SimulatedGPIO(self.world)
+
+    def shift_register(self, data_pin, latch_pin, clock_pin, nb_registers):
+        return SimulatedShiftRegister(self.world, nb_registers)
+
+    def led_strip(self, pin, nb_leds, brightness):
+        return SimulatedLedStrip(nb_leds, brightness)
+
+    def attach_hx711(self, dout_pin, sck_pin):
+        self.world.dout_pin = dout_pin
+        self.world.sck_pin = sck_pin
+# endregion
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        name = os.environ.get(BACKEND_ENV, "rpi")
+        if name == "sim":
+            _backend = SimulatedBackend()
+        elif name == "rpi":
+            _backend = RaspberryBackend()
+        else:
+            raise ValueError(f"Unknown hardware backend '{name}'")
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
@@ -0,0 +1,79 @@
+import threading
+import time
+
+from BlendScheduler import EStep
+from StatesManager import StatesManager
+
+
+class ELine:
+    # nothing known (startup, interrupted blend) : always fully flushed
+    UNKNOWN = "unknown"
+    CLEAN = "clean"
+    PRIMED = "primed"
+
+
+class LineTracker:
+    # what each module's line holds, and the flush policy that follows from it :
+    # - a line flushed less than flush_clean_validity ago is not flushed again before a pour, an older clean line only gets a
+    #   short rinse (flush_rinse_ratio of its flush time)
+    # - a line still primed with the same liquid for less than flush_primed_validity is poured from right away
+    # - with flush_keep_primed, lines are left primed after a pour instead of being flushed
+    def __init__(self, nb_modules):
+        self.lock = threading.Lock()
+        self.lines = [self.make_line(ELine.UNKNOWN) for _ in range(nb_modules)]
+
+    @staticmethod
+    def make_line(state, liquid=None, at=None):
+        return {"state": state, "liquid": liquid, "since": at}
+
+    def pre_flush_time(self, module, now=None):
+        sm = StatesManager()
+        full = sm.get_pump_flush_time(module)
+        now = time.time() if now is None else now
+        line = self.lines[module]
+
+        if line["state"] == ELine.CLEAN:
+            if now - line["since"] <= sm.get_flush_clean_validity():
+                return 0
+            return full * sm.get_flush_rinse_ratio()
+        if line["state"] == ELine.PRIMED:
+            if line["liquid"] == sm.get_pump_liquid(module) and now - line["since"] <= sm.get_flush_primed_validity():
+                return 0
+        return full
+
+    def post_flush_time(self, module):
+        sm = StatesManager()
+        if sm.get_flush_keep_primed():
+            return 0
+        return sm.get_pump_flush_time(module)
+
+    def mark_flushed(self, module, at=None):
+        with self.lock:
+            self.lines[module] = self.make_line(ELine.CLEAN, at=time.time() if at is None else at)
+
+    def mark_primed(self, module, at=None):
+        with self.lock:
+            self.lines[module] = self.make_line(ELine.PRIMED, StatesManager().get_pump_liquid(module), time.time() if at is None else at)
+
+    def invalidate(self, modules):
+        with self.lock:
+            for module in modules:
+                self.lines[int(module)] = self.make_line(ELine.UNKNOWN)
+
+    def record(self, steps, start=None):
+        # state of the lines once these steps ran, start is when the first one started (epoch seconds)
+        start = time.time() - max((s.end for s in steps), default=0) if start is None else start
+        for step in sorted(steps, key=lambda s: s.end):
+            if step.kind == EStep.FLUSH:
+                self.mark_flushed(step.module, start + step.end)
+            elif step.kind == EStep.POUR:
+                self.mark_primed(step.module, start + step.end)
+
+    def get_status(self):
+        now = time.time()
+        with self.lock:
+            return {str(module): {
+                "state": line["state"],
+                "liquid": line["liquid"],
+                "age": None if line["since"] is None else now - line["since"],
+            } for module, line in enumerate(self.lines)}
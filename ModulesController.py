@@ -1,12 +1,22 @@
+import threading
 import time
-
-from RPi import GPIO
-from pi74HC595 import pi74HC595
-import RPi.GPIO as gpio
-from HX711_2 import HX711
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from WeightCellsPool import WeightCellsPool
+from HX711_2 import HX711TimeoutError
+from WeightSampler import WeightSampler
+from WeightAcquisition import WeightAcquisition
+from ZeroTracker import ZeroTracker
+from GravimetricDoser import GravimetricDoser, EDosing
+from PumpCalibration import PumpCalibration
 from StatesManager import StatesManager
-import neopixel
-import board
+from BlendScheduler import BlendScheduler, EStep, Pour
+from LineTracker import LineTracker
+from BlendTimeline import Timeline, TimelineExecutor, BlendPlan
+from RecipeBook import RecipeBook
+from ResourceManager import ResourceManager, EResource
+from Hardware import get_backend
 
 
 DEBUG_MODE = True
@@ -20,51 +30,89 @@ class EComponent:
 
 
 class ModulesController:
-    def __init__(self):
-        gpio.setmode(gpio.BCM)
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else get_backend()
+        self.gpio = self.backend.gpio
+        self.gpio.setmode(self.gpio.BCM)
+
+        StatesManager().load_states()
 
-        self.nb_modules = 8
+        # one 8 bits shift register per module, the chain is as long as the configured module count
+        self.nb_modules = StatesManager().get_nb_modules()
         self.bits = 8
+        # register chain, weight cell bus and pumps, each operation only waits for the ones it uses
+        self.resources = ResourceManager(self.nb_modules)
 
         self.initial_blend_time = 0
         self.remaining_blend_time = 0
+        self.timeline_executor = TimelineExecutor(self.apply_changes)
+        self.cup_swapped = threading.Event()
+        self.lines = LineTracker(self.nb_modules)
+        # returns the data of the next queued order or None, set by the orders queue (see plan_pipelining)
+        self.next_blend = None
+        # optimized schedules by pours and settings, the orders list asks for the same etas over and over
+        self.schedule_cache = OrderedDict()
+        self.schedule_cache_size = 128
+        self.schedule_cache_lock = threading.Lock()
 
         self.enable_pin = 22
-        gpio.setup(self.enable_pin, gpio.OUT)
-        gpio.output(self.enable_pin, gpio.HIGH)
-
-        StatesManager().load_states()
+        self.gpio.setup(self.enable_pin, self.gpio.OUT)
+        self.gpio.output(self.enable_pin, self.gpio.HIGH)
 
         # _, weight_cell, main_pump, valve, small_motor, _, _, _
-        self.modules_states = [False for _ in range(self.nb_modules * self.bits)]
+        # the sampler thread and the blend thread both latch the register
+        self.register_lock = self.resources.get(EResource.REGISTER)
+        # bitmask, bit (module * bits + component) drives that component of that module
+        self.modules_states = 0
+        # last image shifted out, None until the first latch
+        self.sent_states = None
+        self.latch_count = 0
+        self.batch_depth = 0
+        self.main_pump_mask = self.component_mask(EComponent.MAIN_PUMP, range(self.nb_modules))
+        self.zero_tracker = None
 
         # shift_registers
         self.sr_data_pin = 10
         self.sr_latch_pin = 12
         self.sr_clock_pin = 14
-        self.shift_register = pi74HC595(self.sr_data_pin, self.sr_latch_pin, self.sr_clock_pin, self.nb_modules)
+        self.shift_register = self.backend.shift_register(self.sr_data_pin, self.sr_latch_pin, self.sr_clock_pin, self.nb_modules)
         self.send_states()
 
         # weight_sensors
         self.ws_dout_pin = 9
         self.ws_clock_pin = 11
+        self.backend.attach_hx711(self.ws_dout_pin, self.ws_clock_pin)
+        self.weight_cells = WeightCellsPool(self, self.ws_dout_pin, self.ws_clock_pin)
         self.modules_weights = [0 for _ in range(self.nb_modules)]
+        sm = StatesManager()
+        self.doser = GravimetricDoser(self)
+        self.weight_sampler = WeightSampler(self, sm.get_sampler_period(), sm.get_sampler_buffer_size(), sm.get_sampler_samples())
+        self.weight_acquisition = WeightAcquisition(self.weight_cells, self.store_weight)
+        self.zero_tracker = ZeroTracker(self, sm.get_zero_tracking_stable_time(), sm.get_zero_tracking_band(),
+                                        sm.get_zero_tracking_max_drift(), sm.get_zero_tracking_max_step())
+        if sm.get_zero_tracking_enabled():
+            self.weight_sampler.add_listener(self.zero_tracker.on_sample)
 
         # led_strip
         self.ls_nb_leds = 1
-        self.ls_pin = board.D21  # GPIO_13
-        self.ls_order = neopixel.GRB
-        self.led_strip = neopixel.NeoPixel(self.ls_pin, self.ls_nb_leds, brightness=0.5, auto_write=False, pixel_order=self.ls_order)
+        self.ls_pin = 21  # board.D21
+        self.led_strip = self.backend.led_strip(self.ls_pin, self.ls_nb_leds, brightness=0.5)
         self.led_strip.fill((255, 255, 255))
 
-        gpio.output(self.enable_pin, gpio.LOW)
+        self.gpio.output(self.enable_pin, self.gpio.LOW)
+
+        self.recipes = RecipeBook(self)
+        self.recipes.load()
 
         self.init_load_cells()
+        if StatesManager().get_sampler_enabled():
+            self.weight_sampler.start()
 
     def read_dout(self):
-        GPIO.setup(self.ws_dout_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        print(f"dout : {GPIO.input(self.ws_dout_pin)}")
-        # GPIO.cleanup(self.ws_dout_pin)
+        with self.resources.hold(EResource.WEIGHT_BUS):
+            self.gpio.setup(self.ws_dout_pin, self.gpio.IN, pull_up_down=self.gpio.PUD_DOWN)
+            print(f"dout : {self.gpio.input(self.ws_dout_pin)}")
+        # self.gpio.cleanup(self.ws_dout_pin)
 
     def init_load_cells(self):
         for i in range(self.nb_modules):
@@ -72,113 +120,176 @@ class ModulesController:
                 StatesManager().set_pump_enabled(i, StatesManager().get_weight_cell_offset(i) != 0)
         self.read_all_weights()
 
+    def get_line_states(self):
+        return self.lines.get_status()
+
+    def get_zero_tracking(self):
+        return self.zero_tracker.get_status()
+
     def get_all_weights(self):
-        return self.modules_weights
+        # answered from memory, "age" tells how old each sample is
+        return self.weight_sampler.get_status()
 
     # region register
+    def component_mask(self, component, modules):
+        mask = 0
+        for module in modules:
+            mask |= 1 << (int(module) * self.bits + component)
+        return mask
+
+    def set_mask(self, on_mask=0, off_mask=0):
+        with self.register_lock:
+            started = on_mask & self.main_pump_mask & ~self.modules_states
+            self.modules_states = (self.modules_states & ~off_mask) | on_mask
+        if started and self.zero_tracker is not None:
+            # a bottle being poured from is no drift reference anymore
+            for module in range(self.nb_modules):
+                if started >> (module * self.bits + EComponent.MAIN_PUMP) & 1:
+                    self.zero_tracker.invalidate(module)
+
+    def set_components_state(self, component, modules, on):
+        # e.g. set_components_state(EComponent.VALVE, {1, 3, 4}, True) opens three valves in one go
+        mask = self.component_mask(component, modules)
+        if on:
+            self.set_mask(on_mask=mask)
+        else:
+            self.set_mask(off_mask=mask)
+
+    def get_component_state(self, module, component):
+        return bool(self.modules_states >> (module * self.bits + component) & 1)
+
     def set_main_pump_state(self, module, on):
         if DEBUG_MODE:
             print("::set_main_pump_state", module, on)
         # '-' first module is last to receive data
-        self.modules_states[module * self.bits + EComponent.MAIN_PUMP] = on
+        self.set_components_state(EComponent.MAIN_PUMP, (module,), on)
 
     def set_flush_pump_state(self, module, on):
         if DEBUG_MODE:
             print("::set_flush_pump_state", module, on)
-        self.modules_states[module * self.bits + EComponent.FLUSH_PUMP] = on
+        self.set_components_state(EComponent.FLUSH_PUMP, (module,), on)
 
     def set_weight_cell_state(self, module, on):
         if DEBUG_MODE:
             print("::set_weight_cell_state", module, on)
-        self.modules_states[module * self.bits + EComponent.WEIGHT_CELL] = on
+        self.set_components_state(EComponent.WEIGHT_CELL, (module,), on)
 
     def set_valve_state(self, module, open):
         if DEBUG_MODE:
             print("::set_valve_state", module, open)
-        self.modules_states[module * self.bits + EComponent.VALVE] = open
-
-    def send_states(self):
-        for i in range(4):
-            print([1 if x else 0 for x in self.modules_states][i*8:i*8+8])
-        self.shift_register.set_by_list(self.modules_states[::-1])
+        self.set_components_state(EComponent.VALVE, (module,), open)
+
+    def send_states(self, force=False):
+        # only latches when the image changed since the last latch, and not inside a transaction
+        with self.register_lock:
+            if self.batch_depth > 0:
+                return
+            states = self.modules_states
+            if not force and states == self.sent_states:
+                return
+            if DEBUG_MODE:
+                for i in range(self.nb_modules):
+                    print([(states >> (i * self.bits + bit)) & 1 for bit in range(self.bits)])
+            # big endian : the first byte shifted is the last module, module 0 ends up closest to the pi
+            self.shift_register.set_by_bytes(states.to_bytes(self.nb_modules, 'big'))
+            self.sent_states = states
+            self.latch_count += 1
+
+    @contextmanager
+    def transaction(self):
+        # every set_*_state / send_states inside the block ends up in a single latch when it exits
+        with self.register_lock:
+            self.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if self.batch_depth == 0:
+                    self.send_states()
     # endregion
 
     # region weight_cells
-    def read_weight(self, module):
-        module = int(module)
+    def store_weight(self, module, value, timestamp=None):
+        self.modules_weights[module] = value
+        self.weight_sampler.record(module, value, timestamp)
 
-        self.set_weight_cell_state(module, True)
-        self.send_states()
+    def read_adaptive(self, modules):
+        # each cell is sampled until its standard error is below weight_tolerance, or weight_max_samples
         sm = StatesManager()
-        sensor = HX711(self.ws_dout_pin, self.ws_clock_pin)
-        sensor.set_reading_format("MSB", "MSB")
-        sensor.reset()
-        sensor.set_reference_unit_A(sm.get_weight_cell_reference_unit(module))
-        sensor.set_offset(sm.get_weight_cell_offset(module))
-        val = sensor.get_weight(10)
-        sensor.power_down()
-        sensor.stop()
-        self.modules_weights[module] = val
-        self.set_weight_cell_state(module, False)
-        self.send_states()
-        return True
+        return self.weight_acquisition.refresh(modules, sm.get_weight_max_samples(), retry_failed=True,
+                                               tolerance=sm.get_weight_tolerance(), min_samples=sm.get_weight_min_samples())
+
+    def read_weight(self, module):
+        # returns the weight with its standard error (grams) and sample count, False if the cell did not answer
+        module = int(module)
+        weights = self.read_adaptive([module])
+        if module not in weights:
+            return False
+        stderr, samples = self.weight_acquisition.quality[module]
+        return {"weight": weights[module], "stderr": stderr, "samples": samples}
 
     def read_some_weights(self, modules):
-        for i in modules:
-            self.read_weight(int(i))
+        # returns the weights that could be read, by module
+        return self.read_adaptive(modules)
 
-    def read_all_weights(self):
-        for i in range(self.nb_modules):
-            if StatesManager().get_pump_enabled(i):
-                self.read_weight(i)
+    def read_all_weights(self, max_age=None):
+        # max_age : only the cells not read for that many seconds are refreshed
+        modules = [i for i in range(self.nb_modules) if StatesManager().get_pump_enabled(i)]
+        self.weight_acquisition.refresh(modules, StatesManager().get_sampler_samples(), max_age)
         return True
 
     def tare_weight_cell(self, module):
+        # False if the cell can't be tared, None if its pump is busy (blend running), the caller retries later
         module = int(module)
 
         if not StatesManager().get_pump_enabled(module):
             return False
 
-        self.set_weight_cell_state(module, True)
-        self.send_states()
         sm = StatesManager()
-        time.sleep(0.1)
-        sensor = HX711(self.ws_dout_pin, self.ws_clock_pin)
-        sensor.set_reading_format("MSB", "MSB")
-        sensor.reset()
-        sensor.set_reference_unit(sm.get_weight_cell_reference_unit(module))
-        sensor.tare(10)
-        sensor.power_down()
-        sensor.stop()
-        sm.set_weight_cell_offset(module, sensor.OFFSET)
-        self.set_weight_cell_state(module, False)
-        self.send_states()
-        return True
+        try:
+            # the bottle must not be poured from while its cell is tared, a blend is not waited for
+            with self.resources.hold_available(EResource.pump(module)) as taken:
+                if not taken:
+                    return None
+                offset, stderr, samples = self.weight_cells.tare(module, sm.get_weight_max_samples(), sm.get_weight_tolerance(), sm.get_weight_min_samples())
+        except HX711TimeoutError as e:
+            print(f"tare_weight_cell {module} : {e}")
+            return False
+        sm.set_weight_cell_offset(module, offset)
+        self.zero_tracker.reset_drift(module)
+        return {"offset": offset, "stderr": stderr, "samples": samples}
 
     def tare_all_cells(self):
+        # returns the modules left out because their pump was busy
+        busy = []
         for i in range(self.nb_modules):
             if StatesManager().get_pump_enabled(i):
-                self.tare_weight_cell(i)
-        return True
+                if self.tare_weight_cell(i) is None:
+                    busy.append(i)
+        return busy
     # endregion
 
     # region serve
-    def flush(self, module, pre_send=True, post_send=True):
+    def flush(self, module, pre_send=True, post_send=True, duration=None):
         if DEBUG_MODE:
             print("flush", module, pre_send, post_send)
         module = int(module)
+        if duration is None:
+            duration = StatesManager().get_pump_flush_time(module)
 
-        self.set_valve_state(module, open=True)
-        self.set_flush_pump_state(module, on=True)
-        if pre_send:
-            self.send_states()
+        with self.resources.hold(EResource.pump(module)):
+            self.set_valve_state(module, open=True)
+            self.set_flush_pump_state(module, on=True)
+            if pre_send:
+                self.send_states()
 
-        time.sleep(3)
+            time.sleep(duration)
 
-        self.set_valve_state(module, open=False)
-        self.set_flush_pump_state(module, on=False)
-        if post_send:
-            self.send_states()
+            self.set_valve_state(module, open=False)
+            self.set_flush_pump_state(module, on=False)
+            if post_send:
+                self.send_states()
+            self.lines.mark_flushed(module)
         return True
 
     def pump(self, module, _time, pre_send=True, post_send=True):
@@ -186,80 +297,392 @@ class ModulesController:
             print("pump", module, _time, pre_send, post_send)
 
         module = int(module)
-        self.set_main_pump_state(module, on=True)
-        if pre_send:
-            self.send_states()
+        with self.resources.hold(EResource.pump(module)):
+            self.set_main_pump_state(module, on=True)
+            if pre_send:
+                self.send_states()
 
-        time.sleep(_time)
+            time.sleep(_time)
 
-        self.set_main_pump_state(module, on=False)
-        if post_send:
-            self.send_states()
+            self.set_main_pump_state(module, on=False)
+            if post_send:
+                self.send_states()
         return True
 
-    def serve(self, module, quantity, post_send=True):
-        module = int(module)
-        _time = quantity * StatesManager().get_pump_speed_ratio(module) * StatesManager().get_sec_per_liter()
-
-        self.flush(module, post_send=False)
-        self.pump(module, _time, post_send=False)
-        self.flush(module, post_send=post_send)
+    # region calibration
+    def get_calibration(self, module):
+        return PumpCalibration(StatesManager().get_pump_calibration(module))
+
+    def get_pump_time(self, module, quantity):
+        calibration = self.get_calibration(module)
+        if calibration.is_ready():
+            return calibration.pump_time(quantity * StatesManager().get_liquid_density())
+        return quantity * StatesManager().get_pump_speed_ratio(module) * StatesManager().get_sec_per_liter()
+
+    def learn_from_pours(self, weights_before, weights_after, pump_times):
+        # a bottle loses what its pump poured, feed (pump time, grams) to each module fit
+        for module, pump_time in pump_times.items():
+            if module not in weights_before or module not in weights_after:
+                continue
+            calibration = self.get_calibration(module)
+            if calibration.add(pump_time, weights_before[module] - weights_after[module]):
+                print(f"calibration {module} : {calibration.rate():.2f} g/s, {calibration.intercept():.2f} g")
+            StatesManager().set_pump_calibration(module, calibration.to_dict())
+
+    def reset_calibration(self, module):
+        StatesManager().set_pump_calibration(int(module), None)
+        return True
+    # endregion
 
-    def blend(self, data, status_callback):
-        # handle callback
+    def serve(self, module, quantity, post_send=True, dosing=EDosing.TIMED):
+        # returns how long the main pump ran
+        module = int(module)
+        _time = self.get_pump_time(module, quantity)
+
+        pre_flush = self.lines.pre_flush_time(module)
+        if pre_flush > 0:
+            self.flush(module, post_send=False, duration=pre_flush)
+        self.lines.invalidate([module])
+        dosed = None
+        if dosing == EDosing.GRAVIMETRIC and self.doser.is_available(module):
+            dosed = self.doser.dose(module, quantity)
+        if dosed is None:
+            # timed mode, or the weight cell is not usable
+            self.pump(module, _time, post_send=False)
+        else:
+            _time = dosed[1]
+        self.send_states()
+        # the line is flushed once the liquid in it reached the cup
+        time.sleep(StatesManager().get_pump_delay_for_distance(module))
+        post_flush = self.lines.post_flush_time(module)
+        if post_flush > 0:
+            self.flush(module, post_send=post_send, duration=post_flush)
+        else:
+            self.lines.mark_primed(module)
+        return _time
+
+    def get_pours(self, data, first=True, last=True):
+        # the flushes around each pour follow the state of its line (see LineTracker),
+        # in a batch the lines are only flushed before the first cup and after the last one
         mix, cup_size = data['ratios'], data['cup_size']
+        sm = StatesManager()
+        pours = []
         for module, ratio in mix.items():
-            self.serve(module, cup_size * ratio, post_send=False)
-        self.send_states()
-
-        self.read_some_weights(list(mix.keys()))
-
+            module = int(module)
+            pours.append(Pour(
+                module,
+                self.get_pump_time(module, cup_size * ratio),
+                sm.get_pump_delay_for_distance(module),
+                self.lines.pre_flush_time(module) if first else 0,
+                self.lines.post_flush_time(module) if last else 0,
+            ))
+        return pours
+
+    def get_scheduler(self):
+        return BlendScheduler(StatesManager().get_max_concurrent_pumps())
+
+    def schedule_pours(self, pours):
+        key = (tuple(pours), StatesManager().get_max_concurrent_pumps())
+        with self.schedule_cache_lock:
+            steps = self.schedule_cache.get(key)
+            if steps is not None:
+                self.schedule_cache.move_to_end(key)
+                return steps
+        steps = self.get_scheduler().optimize(pours)
+        with self.schedule_cache_lock:
+            self.schedule_cache[key] = steps
+            if len(self.schedule_cache) > self.schedule_cache_size:
+                self.schedule_cache.popitem(last=False)
+        return steps
+
+    def plan_blend(self, data):
+        return self.schedule_pours(self.get_pours(data))
+
+    def validate_blend(self, data, action=None):
+        # raises ValueError on blend data that can't be poured, before it is queued or saved anywhere
+        # action : the order it is for, batch_blend needs a cup count and blend / faster_blend only pour one cup
+        if not isinstance(data, dict):
+            raise ValueError("blend data must be an object")
+        ratios = data.get('ratios')
+        if not isinstance(ratios, dict) or not ratios:
+            raise ValueError("ratios must be a non empty object")
+        seen = set()
+        for module, ratio in ratios.items():
+            try:
+                module = int(module)
+            except (TypeError, ValueError):
+                raise ValueError(f"invalid module {module!r}")
+            if module in seen:
+                # e.g. "1" and "01", two chains on the same pump
+                raise ValueError(f"module {module} given twice")
+            seen.add(module)
+            if not 0 <= module < self.nb_modules:
+                raise ValueError(f"module {module} out of range (0 to {self.nb_modules - 1})")
+            if isinstance(ratio, bool) or not isinstance(ratio, (int, float)) or not 0 <= ratio < float("inf"):
+                raise ValueError(f"invalid ratio {ratio!r} for module {module}")
+        cup_size = data.get('cup_size')
+        if isinstance(cup_size, bool) or not isinstance(cup_size, (int, float)) or not 0 < cup_size < float("inf"):
+            raise ValueError(f"cup_size must be a positive number, got {cup_size!r}")
+        if data.get('dosing', EDosing.TIMED) not in (EDosing.TIMED, EDosing.GRAVIMETRIC):
+            raise ValueError(f"unknown dosing {data['dosing']!r}")
+        if action == 'batch_blend' and 'cups' not in data:
+            raise ValueError("cups is required for a batch")
+        cups = data.get('cups', 1)
+        if isinstance(cups, bool) or not isinstance(cups, int) or cups < 1:
+            raise ValueError(f"cups must be a positive integer, got {cups!r}")
+        if action in ('blend', 'faster_blend') and cups != 1:
+            raise ValueError("a blend pours one cup, use batch_blend for several")
+
+    def describe_blend(self, data):
+        # predicted duration and pour schedule of a blend, nothing is poured
+        steps = self.plan_blend(data) if self.is_planned(data) else []
+        return {
+            "predicted_time": self.estimate_blend_time(data),
+            "steps": [step.to_dict() for step in sorted(steps, key=lambda s: (s.start, s.module))],
+        }
+
+    def is_planned(self, data):
+        # gravimetric blends are dosed on the fly, only timed ones have a plan
+        return data.get('dosing', StatesManager().get_dosing_mode()) != EDosing.GRAVIMETRIC
+
+    def plan_key(self, data):
+        # every config value a plan of that blend depends on
+        sm = StatesManager()
+        modules = sorted(int(module) for module in data['ratios'].keys())
+        return (
+            sm.get_sec_per_liter(), sm.get_max_concurrent_pumps(), sm.get_liquid_density(),
+            tuple((module, sm.get_pump_enabled(module), sm.get_pump_speed_ratio(module), sm.get_pump_delay_for_distance(module),
+                   sm.get_pump_flush_time(module), repr(sm.get_pump_calibration(module))) for module in modules),
+        )
+
+    def prepare_blend(self, data, pours=None):
+        pours = self.get_pours(data) if pours is None else pours
+        steps = self.schedule_pours(pours)
+        pump_times = {step.module: step.duration for step in steps if step.kind == EStep.POUR}
+        return BlendPlan(steps, self.compile_timeline(steps), pump_times, self.plan_key(data), pours)
+
+    def get_plan(self, data):
+        # orders made from a recipe come with a plan compiled ahead of time, it holds as long as the lines are in the same state
+        pours = self.get_pours(data)
+        plan = self.recipes.find_plan(data)
+        if plan is not None and plan.pours == pours:
+            return plan
+        return self.prepare_blend(data, pours)
+
+    def estimate_blend_time(self, data):
+        if int(data.get('cups', 1)) > 1:
+            return self.estimate_batch_time(data)
+        dosing = data.get('dosing', StatesManager().get_dosing_mode())
+        if dosing == EDosing.GRAVIMETRIC:
+            return sum(p.flush_before + p.pour_time + p.line_delay + p.flush_after for p in self.get_pours(data))
+        return self.get_plan(data).total_time
+
+    def step_components(self, step):
+        if step.kind == EStep.FLUSH:
+            return EComponent.VALVE, EComponent.FLUSH_PUMP
+        if step.kind == EStep.TRANSIT:
+            return ()
+        return EComponent.MAIN_PUMP,
+
+    def plan_pipelining(self, steps, modules):
+        # flushes the next order's lines the current blend does not use with the pumps it leaves idle,
+        # so the next order starts without them. Only what fits before the current blend ends is done.
+        if self.next_blend is None or not StatesManager().get_order_pipelining():
+            return []
+        data = self.next_blend()
+        if not data or 'ratios' not in data:
+            return []
+        sm = StatesManager()
+        pours = []
+        for module in dict.fromkeys(int(m) for m in data['ratios']):
+            if module in modules or not 0 <= module < self.nb_modules or not sm.get_pump_enabled(module):
+                continue
+            flush_time = self.lines.pre_flush_time(module)
+            if flush_time > 0:
+                pours.append(Pour(module, 0, 0, flush_time, 0))
+        if not pours:
+            return []
+        return self.get_scheduler().fill(steps, pours, BlendScheduler.total_time(steps))
+
+    def compile_timeline(self, steps):
+        entries = []
+        for step in steps:
+            for component in self.step_components(step):
+                bit = step.module * self.bits + component
+                entries.append((step.start, bit, True))
+                entries.append((step.end, bit, False))
+        return Timeline.compile(entries, BlendScheduler.total_time(steps))
+
+    def apply_changes(self, changes):
+        on_mask, off_mask = changes
+        with self.transaction():
+            self.set_mask(on_mask, off_mask)
+
+    def get_blend_status(self):
+        initial = self.initial_blend_time
+        remaining = self.remaining_blend_time
+        progress = 1 - remaining / initial if initial > 0 else 0
+        return {"initial_time": round(initial, 1), "remaining_time": round(remaining, 1), "progress": round(progress, 3)}
+
+    def start_blend_status(self, total_time, status_callback):
+        self.initial_blend_time = total_time
+        self.remaining_blend_time = total_time
+        if status_callback:
+            status_callback(self.get_blend_status())
+
+    def update_blend_status(self, remaining_time, status_callback):
+        self.remaining_blend_time = max(0, remaining_time)
+        if status_callback:
+            status_callback(self.get_blend_status())
+
+    def run_timeline(self, timeline, status_callback, remaining_after=None):
+        # remaining_after : time left once this timeline is done, when it is only one part of the job
+        if remaining_after is None:
+            self.start_blend_status(timeline.total_time, status_callback)
+            remaining_after = 0
+        done = False
+        try:
+            duration = self.timeline_executor.run(
+                timeline,
+                lambda elapsed: self.update_blend_status(timeline.total_time - elapsed + remaining_after, status_callback)
+            )
+            done = True
+        finally:
+            if not done:
+                # stopped halfway (latch or status callback error), nothing it switched on may keep running
+                with self.register_lock:
+                    self.set_mask(off_mask=timeline.on_mask)
+                    self.send_states(force=True)
+        if DEBUG_MODE:
+            print(f"timeline done in {duration:.3f}s for {timeline.total_time:.3f}s, max lateness {self.timeline_executor.max_lateness * 1000:.1f}ms")
         return True
 
-    def faster_blend(self, data, status_callback):
-        mix, cup_size = data['ratios'], data['cup_size']
-        mix = list(mix.items())
-
-        module_0 = int(mix[0][0])
-        ratio_0 = mix[0][1]
-
-        self.flush(module_0, post_send=False)
-
-        _time = cup_size * ratio_0 * StatesManager().get_pump_speed_ratio(module_0) * StatesManager().get_sec_per_liter()
-        self.pump(module_0, _time, post_send=False)
-
-        for i in range(1, len(mix)):
-            prev_module, _ = mix[i-1]
-            module, ratio = mix[i]
-            prev_module = int(prev_module)
-            module = int(module)
+    def blend(self, data, status_callback):
+        modules = [int(module) for module in data['ratios'].keys()]
+        # nothing else drives or tares these modules until the blend is over
+        with self.resources.hold(*self.resources.pumps(modules)):
+            return self.run_blend(data, modules, status_callback)
 
-            # make both flush at the same time !
-            # region flush
-            self.set_valve_state(prev_module, open=True)
-            self.set_flush_pump_state(prev_module, on=True)
-            self.set_valve_state(module, open=True)
-            self.set_flush_pump_state(module, on=True)
-            self.send_states()
+    def run_blend(self, data, modules, status_callback):
+        mix, cup_size = data['ratios'], data['cup_size']
+        weights_before = self.read_some_weights(modules)
+
+        dosing = data.get('dosing', StatesManager().get_dosing_mode())
+        try:
+            if dosing == EDosing.GRAVIMETRIC:
+                # only one cell can be read at a time, pours are done one after the other
+                pump_times = {}
+                self.start_blend_status(self.estimate_blend_time(data), status_callback)
+                remaining = dict(mix)
+                for module, ratio in mix.items():
+                    pump_times[int(module)] = self.serve(module, cup_size * ratio, post_send=False, dosing=dosing)
+                    del remaining[module]
+                    self.update_blend_status(self.estimate_blend_time(dict(data, ratios=remaining)), status_callback)
+                self.send_states()
+            else:
+                plan = self.get_plan(data)
+                prepared = self.plan_pipelining(plan.steps, modules)
+                # the next order's lines are only prepared if nothing else is using them right now
+                with self.resources.hold_available(*self.resources.pumps({step.module for step in prepared})) as taken:
+                    prepared = [step for step in prepared if EResource.pump(step.module) in taken]
+                    steps, timeline = plan.steps, plan.timeline
+                    if prepared:
+                        steps = plan.steps + prepared
+                        timeline = self.compile_timeline(steps)
+                    if DEBUG_MODE:
+                        print("blend plan", steps, plan.total_time)
+                    # whatever happens in between, the lines are in an unknown state until the timeline is done
+                    self.lines.invalidate(modules + [step.module for step in prepared])
+                    self.run_timeline(timeline, status_callback)
+                    self.lines.record(steps)
+                pump_times = plan.pump_times
+        finally:
+            self.remaining_blend_time = 0
+
+        # the bottles were just poured from, their filters must not average in the weights from before
+        for module in modules:
+            self.weight_cells.reset_filter(module)
+        weights_after = self.read_some_weights(modules)
+        self.learn_from_pours(weights_before, weights_after, pump_times)
 
-            time.sleep(3)
+        return True
 
-            self.set_valve_state(prev_module, open=False)
-            self.set_flush_pump_state(prev_module, on=False)
-            self.set_valve_state(module, open=False)
-            self.set_flush_pump_state(module, on=False)
-            self.send_states()
-            # endregion
+    # region batch
+    def plan_batch(self, data):
+        # one schedule per cup, lines are flushed before the first cup and after the last one only
+        cups = int(data['cups'])
+        return [self.schedule_pours(self.get_pours(data, first=cup == 0, last=cup == cups - 1)) for cup in range(cups)]
 
-            _time = cup_size * ratio * StatesManager().get_pump_speed_ratio(module) * StatesManager().get_sec_per_liter()
-            self.pump(module, _time)
+    def estimate_batch_time(self, data):
+        # cup swaps not included
+        return sum(BlendScheduler.total_time(steps) for steps in self.plan_batch(data))
 
-        self.flush(int(mix[-1][0]))
+    def cup_ready(self):
+        self.cup_swapped.set()
+        return True
 
-        self.read_some_weights(list(data['ratios'].keys()))
+    def wait_cup_swap(self, cup, cups, status_callback):
+        self.cup_swapped.clear()
+        if status_callback:
+            status_callback(dict(self.get_blend_status(), cup=cup + 1, cups=cups, waiting_for_cup=True))
+        return self.cup_swapped.wait(StatesManager().get_cup_swap_timeout())
+
+    def batch_blend(self, data, status_callback):
+        # serves data['cups'] cups of the same blend, the status asks for a cup swap between two cups (see cup_ready)
+        modules = [int(module) for module in data['ratios'].keys()]
+        with self.resources.hold(*self.resources.pumps(modules)):
+            return self.run_batch(data, modules, status_callback)
+
+    def run_batch(self, data, modules, status_callback):
+        cups = int(data['cups'])
+        weights_before = self.read_some_weights(modules)
+
+        plans = self.plan_batch(data)
+        times = [BlendScheduler.total_time(steps) for steps in plans]
+        self.start_blend_status(sum(times), status_callback)
+
+        served = 0
+        try:
+            for cup, steps in enumerate(plans):
+                if cup > 0:
+                    if not self.wait_cup_swap(cup, cups, status_callback):
+                        print(f"batch_blend : no cup swap after cup {cup}, stopping")
+                        break
+                def cup_status(status):
+                    if status_callback:
+                        status_callback(dict(status, cup=cup + 1, cups=cups))
+
+                self.lines.invalidate(modules)
+                self.run_timeline(self.compile_timeline(steps), cup_status, sum(times[cup + 1:]))
+                self.lines.record(steps)
+                served += 1
+
+                # the weights are read while the cup is being swapped anyway, each cup teaches the calibration
+                for module in modules:
+                    self.weight_cells.reset_filter(module)
+                weights_after = self.read_some_weights(modules)
+                self.learn_from_pours(weights_before, weights_after, {step.module: step.duration for step in steps if step.kind == EStep.POUR})
+                weights_before = weights_after
+
+            if served < cups:
+                # stopped early, the lines still hold liquid
+                steps = self.get_scheduler().schedule([Pour(module, 0, 0, 0, self.lines.post_flush_time(module)) for module in modules])
+                self.run_timeline(self.compile_timeline(steps), status_callback, 0)
+                self.lines.record(steps)
+        finally:
+            self.remaining_blend_time = 0
+        return served == cups
+    # endregion
 
-        return True
+    def faster_blend(self, data, status_callback):
+        # blend is scheduled with overlapping flushes and pours, there is nothing faster left
+        return self.blend(data, status_callback)
     # endregion
 
     def cleanup(self):
-        self.shift_register.clear()
+        self.weight_sampler.stop()
+        self.weight_cells.close()
+        with self.register_lock:
+            self.shift_register.clear()
+            self.modules_states = 0
+            self.sent_states = 0
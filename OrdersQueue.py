@@ -0,0 +1,206 @@
+import json
+import os
+import threading
+import time
+import traceback
+
+from StatesManager import write_json_atomic
+
+
+class EOrderState:
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+    # was running when the server stopped, never replayed to avoid pouring twice
+    INTERRUPTED = "interrupted"
+
+
+class OrdersQueue:
+    # FIFO of blend orders, persisted on every change so a restart keeps the pending ones
+    def __init__(self, controller, execute, file_path="orders.json", on_change=None, on_status=None):
+        self.controller = controller
+        # execute(action) runs action on the hardware and only returns once it is done
+        self.execute = execute
+        self.file_path = file_path
+        self.on_change = on_change
+        self.on_status = on_status
+
+        self.orders = []
+        # orders that were running when the server stopped, kept until cancelled so the client can see them
+        self.interrupted = []
+        self.next_id = 1
+        self.running = None
+        self.condition = threading.Condition()
+        self.save_lock = threading.Lock()
+        self.thread = None
+        self.stopped = False
+
+    # region persistence
+    def load(self):
+        if not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        with self.condition:
+            self.next_id = data.get("next_id", 1)
+            self.orders = []
+            self.interrupted = []
+            for order in data.get("orders", []):
+                if order["state"] == EOrderState.RUNNING:
+                    order["state"] = EOrderState.INTERRUPTED
+                    print(f"order {order['id']} was interrupted by a restart, not replayed")
+                if order["state"] == EOrderState.INTERRUPTED:
+                    self.interrupted.append(order)
+                else:
+                    self.orders.append(order)
+
+    def save(self):
+        with self.save_lock:
+            with self.condition:
+                orders = self.interrupted + self.orders
+                if self.running is not None:
+                    orders.insert(len(self.interrupted), self.running)
+                data = {"next_id": self.next_id, "orders": orders}
+            write_json_atomic(self.file_path, data)
+    # endregion
+
+    # region orders
+    def add(self, action, data):
+        with self.condition:
+            order = {
+                "id": self.next_id,
+                "action": action,
+                "data": data,
+                "state": EOrderState.PENDING,
+                "created_at": time.time(),
+            }
+            self.next_id += 1
+            self.orders.append(order)
+            self.condition.notify_all()
+        self.changed(order)
+        return order
+
+    def find(self, order_id):
+        for order in self.orders + self.interrupted:
+            if order["id"] == order_id:
+                return order
+        return None
+
+    def cancel(self, order_id):
+        with self.condition:
+            order = self.find(order_id)
+            if order is None:
+                return False
+            if order["state"] == EOrderState.INTERRUPTED:
+                self.interrupted.remove(order)
+            else:
+                self.orders.remove(order)
+            order["state"] = EOrderState.CANCELLED
+        self.changed(order)
+        return True
+
+    def move(self, order_id, position):
+        with self.condition:
+            order = self.find(order_id)
+            if order is None or order["state"] != EOrderState.PENDING:
+                return False
+            self.orders.remove(order)
+            position = max(0, min(int(position), len(self.orders)))
+            self.orders.insert(position, order)
+        self.changed(order)
+        return True
+
+    def peek(self):
+        # data of the next pending order, the controller prepares its lines while the current one runs
+        with self.condition:
+            return self.orders[0]["data"] if self.orders else None
+
+    def estimate(self, order):
+        # None when the order can't be planned with the current config (e.g. one of its pumps was removed)
+        try:
+            return self.controller.estimate_blend_time(order["data"])
+        except Exception as e:
+            print(f"order {order['id']} can't be estimated : {e}")
+            return None
+
+    def list(self):
+        # every order with its predicted start and finish time (epoch seconds), None after one that can't be estimated
+        now = time.time()
+        with self.condition:
+            interrupted = list(self.interrupted)
+            running = self.running
+            orders = list(self.orders)
+
+        result = [dict(order, eta_start=None, eta_finish=None) for order in interrupted]
+        at = now
+        if running is not None:
+            duration = self.estimate(running)
+            at = None if duration is None else max(now, running["started_at"] + duration)
+            result.append(dict(running, eta_start=running["started_at"], eta_finish=at))
+        for order in orders:
+            duration = self.estimate(order)
+            finish = None if at is None or duration is None else at + duration
+            result.append(dict(order, eta_start=at, eta_finish=finish))
+            at = finish
+        return result
+
+    def get_eta(self, order_id):
+        for order in self.list():
+            if order["id"] == order_id:
+                return order
+        return None
+
+    def changed(self, order):
+        self.save()
+        if self.on_change is not None:
+            self.on_change(order)
+    # endregion
+
+    # region thread
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped = False
+        self.controller.next_blend = self.peek
+        self.thread = threading.Thread(target=self.run, name="OrdersQueue", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.orders and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                order = self.orders.pop(0)
+                order["state"] = EOrderState.RUNNING
+                order["started_at"] = time.time()
+                self.running = order
+            self.changed(order)
+
+            try:
+                self.execute(lambda: self.run_order(order))
+                order["state"] = EOrderState.DONE
+            except Exception:
+                traceback.print_exc()
+                order["state"] = EOrderState.FAILED
+            order["finished_at"] = time.time()
+
+            with self.condition:
+                self.running = None
+            self.changed(order)
+
+    def run_order(self, order):
+        action = getattr(self.controller, order["action"])
+        action(order["data"], self.on_status or (lambda status: None))
+    # endregion
@@ -0,0 +1,98 @@
+import math
+
+
+class PumpCalibration:
+    # incremental least squares fit of dispensed grams = rate * pump seconds + intercept
+    # older pours fade out with forget_factor, so the fit follows pump wear and bottle level
+    def __init__(self, data=None, forget_factor=0.95, min_samples=3, outlier_sigma=3.0, outlier_ratio=0.25, min_spread=0.25):
+        self.forget_factor = forget_factor
+        # the intercept is only fitted once the pump times spread by that much (standard deviation / mean),
+        # pours of the same cocktail all night are nearly collinear and would give any rate / intercept pair
+        self.min_spread = min_spread
+        self.min_samples = min_samples
+        self.outlier_sigma = outlier_sigma
+        self.outlier_ratio = outlier_ratio
+
+        data = data or {}
+        self.n = data.get("n", 0)
+        self.count = data.get("count", 0)
+        self.st = data.get("st", 0.0)
+        self.sm = data.get("sm", 0.0)
+        self.stt = data.get("stt", 0.0)
+        self.stm = data.get("stm", 0.0)
+        self.smm = data.get("smm", 0.0)
+        self.rejected = data.get("rejected", 0)
+
+    def to_dict(self):
+        return {
+            "n": self.n, "count": self.count,
+            "st": self.st, "sm": self.sm, "stt": self.stt, "stm": self.stm, "smm": self.smm,
+            "rejected": self.rejected,
+            "rate": self.rate(), "intercept": self.intercept(),
+        }
+
+    def is_ready(self):
+        return self.count >= self.min_samples and self.rate() > 0
+
+    def spread(self):
+        # weighted standard deviation of the pump times over their mean
+        if self.n <= 0 or self.st <= 0:
+            return 0.0
+        mean = self.st / self.n
+        return math.sqrt(max(0.0, self.stt / self.n - mean * mean)) / mean
+
+    def _fit(self):
+        det = self.n * self.stt - self.st * self.st
+        if self.n <= 0 or det <= 1e-9 or self.spread() < self.min_spread:
+            # clustered pump times, or no data : line through the origin
+            rate = self.stm / self.stt if self.stt > 0 else 0
+            return rate, 0.0
+        rate = (self.n * self.stm - self.st * self.sm) / det
+        intercept = (self.sm - rate * self.st) / self.n
+        return rate, intercept
+
+    def rate(self):
+        return self._fit()[0]
+
+    def intercept(self):
+        return self._fit()[1]
+
+    def predict_mass(self, pump_time):
+        rate, intercept = self._fit()
+        return rate * pump_time + intercept
+
+    def pump_time(self, mass):
+        rate, intercept = self._fit()
+        return max(0.0, (mass - intercept) / rate)
+
+    def residual_sigma(self):
+        if self.n <= 2:
+            return 0.0
+        rate, intercept = self._fit()
+        sse = self.smm - rate * self.stm - intercept * self.sm
+        return math.sqrt(max(0.0, sse) / (self.n - 2))
+
+    def is_outlier(self, pump_time, mass):
+        if mass <= 0:
+            # nothing came out (empty bottle, cell glitch), never learn from that
+            return True
+        if not self.is_ready():
+            return False
+        predicted = self.predict_mass(pump_time)
+        tolerance = max(self.outlier_sigma * self.residual_sigma(), self.outlier_ratio * abs(predicted))
+        return abs(mass - predicted) > tolerance
+
+    def add(self, pump_time, mass):
+        if pump_time <= 0 or self.is_outlier(pump_time, mass):
+            self.rejected += 1
+            return False
+
+        f = self.forget_factor
+        self.n = self.n * f + 1
+        self.st = self.st * f + pump_time
+        self.sm = self.sm * f + mass
+        self.stt = self.stt * f + pump_time * pump_time
+        self.stm = self.stm * f + pump_time * mass
+        self.smm = self.smm * f + mass * mass
+        self.count += 1
+        return True
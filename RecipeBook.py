@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+
+from StatesManager import StatesManager, write_json_atomic
+
+
+class RecipeBook:
+    # named blends kept on disk, each one compiled to a BlendPlan ahead of time so serving it starts right away
+    def __init__(self, controller, file_path="recipes.json"):
+        self.controller = controller
+        self.file_path = file_path
+
+        self.recipes = {}
+        # name : BlendPlan, with the recipe revision and config version it was compiled for
+        self.plans = {}
+        self.lock = threading.RLock()
+
+    # region persistence
+    def load(self):
+        if not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        recipes = {}
+        for recipe in data.get("recipes", []):
+            try:
+                self.controller.validate_blend(self.to_blend_data(recipe))
+            except (ValueError, KeyError, TypeError) as e:
+                # e.g. saved before nb_modules was lowered, kept out instead of failing the startup
+                print(f"recipe {recipe.get('name')!r} ignored : {e}")
+                continue
+            recipes[recipe["name"]] = recipe
+        with self.lock:
+            self.recipes = recipes
+            self.plans = {}
+        self.refresh()
+
+    def save(self):
+        with self.lock:
+            data = {"recipes": list(self.recipes.values())}
+            write_json_atomic(self.file_path, data)
+    # endregion
+
+    # region recipes
+    def create(self, name, ratios, cup_size, dosing=None):
+        # raises ValueError on ratios or a cup size that can't be poured, nothing is saved then
+        data = {"ratios": ratios, "cup_size": cup_size}
+        if dosing is not None:
+            data["dosing"] = dosing
+        self.controller.validate_blend(data)
+        with self.lock:
+            previous = self.recipes.get(name)
+            recipe = {
+                "name": name,
+                "ratios": {str(module): float(ratio) for module, ratio in ratios.items()},
+                "cup_size": float(cup_size),
+                "revision": previous["revision"] + 1 if previous else 1,
+            }
+            if dosing is not None:
+                recipe["dosing"] = dosing
+            self.recipes[name] = recipe
+            self.plans.pop(name, None)
+            self.save()
+        self.get_plan(name)
+        return recipe
+
+    def delete(self, name):
+        with self.lock:
+            if self.recipes.pop(name, None) is None:
+                return False
+            self.plans.pop(name, None)
+            self.save()
+        return True
+
+    def get(self, name):
+        return self.recipes.get(name)
+
+    def list(self):
+        with self.lock:
+            result = []
+            for name, recipe in self.recipes.items():
+                plan = self.try_plan(name)
+                result.append(dict(recipe, predicted_time=plan.total_time if plan else None))
+            return result
+
+    def disabled_modules(self, recipe):
+        return [int(module) for module in recipe["ratios"] if not StatesManager().get_pump_enabled(int(module))]
+
+    def to_blend_data(self, recipe):
+        # what a blend order of that recipe carries, revision tells blend() whether the cached plan still matches
+        data = {"ratios": dict(recipe["ratios"]), "cup_size": recipe["cup_size"], "recipe": recipe["name"], "revision": recipe["revision"]}
+        if "dosing" in recipe:
+            data["dosing"] = recipe["dosing"]
+        return data
+    # endregion
+
+    # region plans
+    def get_plan(self, name):
+        # None for gravimetric recipes, they are dosed on the fly
+        with self.lock:
+            recipe = self.recipes.get(name)
+            if recipe is None:
+                return None
+            data = self.to_blend_data(recipe)
+            if not self.controller.is_planned(data) or self.disabled_modules(recipe):
+                return None
+
+            version = StatesManager().version
+            cached = self.plans.get(name)
+            if cached is not None:
+                revision, cached_version, plan = cached
+                if revision == recipe["revision"] and cached_version == version:
+                    return plan
+                # the config changed, the plan only has to be redone if something it depends on did
+                if revision == recipe["revision"] and plan.key == self.controller.plan_key(data):
+                    self.plans[name] = (revision, version, plan)
+                    return plan
+
+            plan = self.controller.prepare_blend(data)
+            self.plans[name] = (recipe["revision"], version, plan)
+            return plan
+
+    def try_plan(self, name):
+        # a recipe that can't be planned anymore is reported and left out, the others are still served
+        try:
+            return self.get_plan(name)
+        except Exception as e:
+            print(f"recipe {name!r} can't be planned : {e}")
+            return None
+
+    def find_plan(self, data):
+        # the cached plan of a blend order made from a recipe, if it was not edited since
+        recipe = self.recipes.get(data.get("recipe"))
+        if recipe is None or recipe["revision"] != data.get("revision"):
+            return None
+        return self.get_plan(recipe["name"])
+
+    def refresh(self):
+        # recompiles the plans the last config changes (calibration, speed ratios...) made stale
+        with self.lock:
+            for name in list(self.recipes):
+                self.try_plan(name)
+    # endregion
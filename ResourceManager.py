@@ -0,0 +1,64 @@
+import threading
+from contextlib import contextmanager
+
+
+class EResource:
+    # the shift register chain, every latch goes through it
+    REGISTER = "register"
+    # dout / clock pins shared by every HX711, only the selected cell answers
+    WEIGHT_BUS = "weight_bus"
+
+    @staticmethod
+    def pump(module):
+        # main pump, flush pump and valve of a module, and the bottle on its weight cell
+        return f"pump_{int(module)}"
+
+
+class ResourceManager:
+    # one reentrant lock per shared piece of hardware, an operation only waits for the ones it really uses.
+    # Several of them are always taken in the same order (pumps by module, then the weight bus, then the register)
+    # so two operations can't deadlock : code holding the bus or the register must not ask for a pump.
+    def __init__(self, nb_modules):
+        self.nb_modules = nb_modules
+        self.locks = {EResource.REGISTER: threading.RLock(), EResource.WEIGHT_BUS: threading.RLock()}
+        for module in range(nb_modules):
+            self.locks[EResource.pump(module)] = threading.RLock()
+
+    def get(self, resource):
+        return self.locks[resource]
+
+    def rank(self, resource):
+        if resource == EResource.WEIGHT_BUS:
+            return self.nb_modules, resource
+        if resource == EResource.REGISTER:
+            return self.nb_modules + 1, resource
+        return int(resource[len("pump_"):]), resource
+
+    def pumps(self, modules):
+        return [EResource.pump(module) for module in modules]
+
+    @contextmanager
+    def hold(self, *resources):
+        # e.g. with resources.hold(*resources.pumps([0, 3]), EResource.WEIGHT_BUS): ...
+        taken = []
+        try:
+            for resource in sorted(set(resources), key=self.rank):
+                self.locks[resource].acquire()
+                taken.append(resource)
+            yield self
+        finally:
+            for resource in reversed(taken):
+                self.locks[resource].release()
+
+    @contextmanager
+    def hold_available(self, *resources):
+        # takes the ones that are free right now and yields them, never waits so the order does not matter
+        taken = []
+        try:
+            for resource in dict.fromkeys(resources):
+                if self.locks[resource].acquire(blocking=False):
+                    taken.append(resource)
+            yield taken
+        finally:
+            for resource in reversed(taken):
+                self.locks[resource].release()
@@ -1,4 +1,9 @@
 import json
+import os
+import tempfile
+import threading
+
+from ConfigModel import Config, ConfigSnapshot
 
 
 class Singleton(type):
@@ -10,48 +15,201 @@ class Singleton(type):
         return cls._instances[cls]
 
 
+# read once at import, os.umask can only be read by setting it and that is not thread safe
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def file_mode(path):
+    # mode a rewrite of path keeps : its current one, or what open() would give a new file
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def write_json_atomic(path, data, indent=4):
+    # temp file in the same directory + fsync + rename : a power cut leaves either the old or the new file
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file 0600, the replaced file would keep that
+        os.chmod(tmp_path, file_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
 class StatesManager(metaclass=Singleton):
     def __init__(self):
         self.states_file_path = r"states.json"
-        self.states = {}
+
+        # typed config, every change goes through a setter that holds the lock and bumps the version
+        self.config = Config()
+        self.lock = threading.RLock()
+        self.version = 0
+        self.snapshot = None
+
+        # write-behind : setters only mark the states dirty, a timer writes them once per debounce window
+        self.write_behind = False
+        self.debounce_time = 2.0
+        self.dirty = False
+        self.flush_timer = None
+        self.dirty_lock = threading.Lock()
+        self.write_lock = threading.Lock()
 
     def load_states(self):
         with open(self.states_file_path, 'r', encoding='utf-8') as f:
-            self.states = json.load(f)
+            data = json.load(f)
+        with self.lock:
+            self.config = Config.from_dict(data)
+            self.version += 1
+
+    # region snapshot
+    def get_snapshot(self):
+        # rebuilt only when the version changed since the last call
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+        with self.lock:
+            if self.snapshot is None or self.snapshot.version != self.version:
+                self.snapshot = ConfigSnapshot(self.version, self.config.to_dict())
+            return self.snapshot
+
+    @property
+    def states(self):
+        # read only, use the setters to change anything
+        return self.get_snapshot().data
+
+    def get_config_json(self):
+        return self.get_snapshot().to_json()
+
+    def get_all_full_pump_states_json(self):
+        return self.get_snapshot().to_json("pumps")
+    # endregion
+
+    # region persistence
+    def enable_write_behind(self, debounce_time=None):
+        if debounce_time is not None:
+            self.debounce_time = debounce_time
+        self.write_behind = True
 
     def save_states(self):
-        with open(self.states_file_path, 'w+') as f:
-            json.dump(self.states, f, indent=4)
+        if not self.write_behind:
+            self.write_states()
+            return
+
+        with self.dirty_lock:
+            self.dirty = True
+            if self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.debounce_time, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def flush(self):
+        # writes pending changes right away, to be called on shutdown
+        with self.dirty_lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            if not self.dirty:
+                return
+            self.dirty = False
+        self.write_states()
+
+    def write_states(self):
+        with self.write_lock:
+            with self.lock:
+                data = self.config.to_dict()
+            write_json_atomic(self.states_file_path, data)
+    # endregion
+
+    def get_nb_modules(self):
+        return self.config.globals.nb_modules
+
+    def set_nb_modules(self, nb_modules):
+        # only read at startup, the module chain has to be restarted to use it
+        with self.lock:
+            self.config.resize(int(nb_modules))
+            self.version += 1
+        self.save_states()
 
     # region pump
     # region get
     def get_pump_enabled(self, module):
-        return self.states["pumps"][module]["enabled"]
+        return self.config.pumps[module].enabled
 
     def get_pump_speed_ratio(self, module):
-        return self.states["pumps"][module]["speed_ratio"]
+        return self.config.pumps[module].speed_ratio
 
     def get_pump_delay_for_distance(self, module):
-        return self.states["pumps"][module]["delay_for_distance"]
+        return self.config.pumps[module].delay_for_distance
+
+    def get_pump_calibration(self, module):
+        return self.config.pumps[module].calibration
+
+    def get_pump_flush_time(self, module):
+        flush_time = self.config.pumps[module].flush_time
+        return self.get_flush_time() if flush_time is None else flush_time
+
+    def get_pump_liquid(self, module):
+        return self.config.pumps[module].liquid
 
     def get_full_pump_state(self, module):
-        return self.states["pumps"][module]
+        return self.get_snapshot().data["pumps"][module]
 
     def get_all_full_pump_states(self):
-        return self.states["pumps"]
+        return self.get_snapshot().data["pumps"]
     # endregion
 
     # region set
     def set_pump_enabled(self, module, enabled):
-        self.states["pumps"][module]["enabled"] = enabled
+        with self.lock:
+            self.config.pumps[module].enabled = bool(enabled)
+            self.version += 1
         self.save_states()
 
     def set_pump_speed_ratio(self, module, speed_ratio):
-        self.states["pumps"][module]["speed_ratio"] = speed_ratio
+        with self.lock:
+            self.config.pumps[module].speed_ratio = float(speed_ratio)
+            self.version += 1
         self.save_states()
 
     def set_pump_delay_for_distance(self, module, delay):
-        self.states["pumps"][module]["delay_for_distance"] = delay
+        with self.lock:
+            self.config.pumps[module].delay_for_distance = delay
+            self.version += 1
+        self.save_states()
+
+    def set_pump_calibration(self, module, calibration):
+        with self.lock:
+            self.config.pumps[module].calibration = calibration
+            self.version += 1
+        self.save_states()
+
+    def set_pump_flush_time(self, module, flush_time):
+        with self.lock:
+            self.config.pumps[module].flush_time = None if flush_time is None else float(flush_time)
+            self.version += 1
+        self.save_states()
+
+    def set_pump_liquid(self, module, liquid):
+        with self.lock:
+            self.config.pumps[module].liquid = liquid
+            self.version += 1
         self.save_states()
     # endregion
     # endregion
@@ -59,27 +217,158 @@ class StatesManager(metaclass=Singleton):
     # region weight_cell
     # region get
     def get_weight_cell_offset(self, module):
-        return self.states["weight_cells"][module]["offset"]
+        return self.config.weight_cells[module].offset
 
     def get_weight_cell_reference_unit(self, module):
-        return self.states["weight_cells"][module]["reference_unit"]
+        return self.config.weight_cells[module].reference_unit
     # endregion
 
     # region set
     def set_weight_cell_offset(self, module, offset):
-        self.states["weight_cells"][module]["offset"] = offset
+        with self.lock:
+            self.config.weight_cells[module].offset = offset
+            self.version += 1
         self.save_states()
 
     def set_weight_cell_reference_unit(self, module, reference_unit):
-        self.states["weight_cells"][module]["reference_unit"] = reference_unit
+        with self.lock:
+            self.config.weight_cells[module].reference_unit = reference_unit
+            self.version += 1
         self.save_states()
     # endregion
     # endregion
 
+    # region globals
+    def get_global(self, name):
+        return self.config.globals.get(name)
+
+    def set_global(self, name, value):
+        with self.lock:
+            self.config.globals.set(name, value)
+            self.version += 1
+        self.save_states()
+
     def get_sec_per_liter(self):
-        return self.states["sec_per_liter"]
+        return self.get_global("sec_per_liter")
 
     def set_sec_per_liter(self, value):
-        self.states["sec_per_liter"] = value
-        self.save_states()
+        self.set_global("sec_per_liter", value)
+
+    def get_flush_time(self):
+        return self.get_global("flush_time")
 
+    def set_flush_time(self, value):
+        self.set_global("flush_time", value)
+
+    def get_max_concurrent_pumps(self):
+        return self.get_global("max_concurrent_pumps")
+
+    def set_max_concurrent_pumps(self, value):
+        self.set_global("max_concurrent_pumps", value)
+
+    def get_flush_clean_validity(self):
+        return self.get_global("flush_clean_validity")
+
+    def get_flush_primed_validity(self):
+        return self.get_global("flush_primed_validity")
+
+    def get_flush_rinse_ratio(self):
+        return self.get_global("flush_rinse_ratio")
+
+    def get_flush_keep_primed(self):
+        return self.get_global("flush_keep_primed")
+
+    def set_flush_keep_primed(self, keep):
+        self.set_global("flush_keep_primed", keep)
+
+    def get_order_pipelining(self):
+        return self.get_global("order_pipelining")
+
+    def set_order_pipelining(self, enabled):
+        self.set_global("order_pipelining", enabled)
+
+    def get_cup_swap_timeout(self):
+        return self.get_global("cup_swap_timeout")
+    # endregion
+
+    # region weight_sampler
+    def get_sampler_enabled(self):
+        return self.get_global("sampler_enabled")
+
+    def set_sampler_enabled(self, enabled):
+        self.set_global("sampler_enabled", enabled)
+
+    def get_sampler_period(self):
+        return self.get_global("sampler_period")
+
+    def get_sampler_buffer_size(self):
+        return self.get_global("sampler_buffer_size")
+
+    def get_sampler_samples(self):
+        return self.get_global("sampler_samples")
+    # endregion
+
+    # region dosing
+    def get_dosing_mode(self):
+        return self.get_global("dosing_mode")
+
+    def set_dosing_mode(self, mode):
+        self.set_global("dosing_mode", mode)
+
+    def get_dosing_latency(self):
+        return self.get_global("dosing_latency")
+
+    def get_liquid_density(self):
+        return self.get_global("liquid_density")
+    # endregion
+
+    # region weight_reads
+    def get_weight_tolerance(self):
+        return self.get_global("weight_tolerance")
+
+    def set_weight_tolerance(self, value):
+        self.set_global("weight_tolerance", value)
+
+    def get_weight_min_samples(self):
+        return self.get_global("weight_min_samples")
+
+    def get_weight_max_samples(self):
+        return self.get_global("weight_max_samples")
+    # endregion
+
+    # region zero_tracking
+    def get_zero_tracking_enabled(self):
+        return self.get_global("zero_tracking_enabled")
+
+    def set_zero_tracking_enabled(self, enabled):
+        self.set_global("zero_tracking_enabled", enabled)
+
+    def get_zero_tracking_stable_time(self):
+        return self.get_global("zero_tracking_stable_time")
+
+    def get_zero_tracking_band(self):
+        return self.get_global("zero_tracking_band")
+
+    def get_zero_tracking_max_drift(self):
+        return self.get_global("zero_tracking_max_drift")
+
+    def get_zero_tracking_max_step(self):
+        return self.get_global("zero_tracking_max_step")
+    # endregion
+
+    # region weight_filter
+    def get_weight_filter_settings(self):
+        # keyword arguments of WeightFilters.make_filter
+        return {
+            "kind": self.get_global("weight_filter"),
+            "window": self.get_global("weight_filter_window"),
+            "alpha": self.get_global("weight_filter_alpha"),
+            "process_noise": self.get_global("weight_filter_process_noise"),
+            "measurement_noise": self.get_global("weight_filter_measurement_noise"),
+            "outlier_threshold": self.get_global("weight_outlier_threshold"),
+            "outlier_max_rejects": self.get_global("weight_outlier_max_rejects"),
+        }
+
+    def set_weight_filter(self, kind):
+        self.set_global("weight_filter", kind)
+    # endregion
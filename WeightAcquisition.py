@@ -0,0 +1,79 @@
+import time
+
+from HX711_2 import HX711TimeoutError
+
+
+class WeightAcquisition:
+    # refreshes several cells in a row on the shared bus, the next cell is selected (and starts settling)
+    # before the samples of the previous one are converted and handed out
+    def __init__(self, pool, on_sample=None, retry_period=10.0):
+        self.pool = pool
+        # on_sample(module, weight, timestamp)
+        self.on_sample = on_sample
+        # a cell that timed out is left out of bulk refreshes for that long, an unplugged cell costs a full read timeout
+        self.retry_period = retry_period
+
+        self.last_read = {}
+        self.failed_at = {}
+        # (standard error in grams, samples taken) of the last read of each cell
+        self.quality = {}
+
+    def is_stale(self, module, max_age, now):
+        last = self.last_read.get(module)
+        return max_age is None or last is None or now - last > max_age
+
+    def is_failing(self, module, now):
+        failed_at = self.failed_at.get(module)
+        return failed_at is not None and now - failed_at < self.retry_period
+
+    def plan(self, modules, max_age=None, retry_failed=False):
+        now = time.monotonic()
+        order = []
+        for module in dict.fromkeys(int(m) for m in modules):
+            if not self.is_stale(module, max_age, now):
+                continue
+            if not retry_failed and self.is_failing(module, now):
+                continue
+            order.append(module)
+        # the cell already selected needs no switch, the others follow the chain
+        selected = self.pool.selected
+        order.sort(key=lambda m: (m != selected, m))
+        return order
+
+    def deliver(self, module, values, timestamp, weights, samples):
+        weight = self.pool.filtered_weight(module, values)
+        weights[module] = weight
+        self.quality[module] = (self.pool.standard_error(module, values), len(values))
+        samples.append((module, weight, timestamp))
+
+    def refresh(self, modules, times=3, max_age=None, retry_failed=False, tolerance=None, min_samples=3):
+        # reads the given cells (only the ones older than max_age if set), returns {module: weight} for the ones that answered
+        # with a tolerance each cell is sampled until its standard error is below it, times is then the max count
+        weights = {}
+        # handed to on_sample once the bus is released, its listeners (websocket, zero tracking) must not hold it
+        samples = []
+        pending = None
+        with self.pool.lock:
+            for module in self.plan(modules, max_age, retry_failed):
+                self.pool.select(module)
+                if pending is not None:
+                    self.deliver(*pending, weights, samples)
+                    pending = None
+
+                try:
+                    values = self.pool.read_raw(module, times, tolerance, min_samples)
+                except HX711TimeoutError as e:
+                    print(f"weight cell {module} : {e}")
+                    self.failed_at[module] = time.monotonic()
+                    continue
+                self.failed_at.pop(module, None)
+                self.last_read[module] = time.monotonic()
+                pending = (module, values, time.time())
+
+            if pending is not None:
+                self.deliver(*pending, weights, samples)
+
+        if self.on_sample is not None:
+            for sample in samples:
+                self.on_sample(*sample)
+        return weights
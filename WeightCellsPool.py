@@ -0,0 +1,138 @@
+import statistics
+import time
+
+from HX711_2 import HX711
+from WeightFilters import make_filter, median_standard_error
+from StatesManager import StatesManager
+from ResourceManager import EResource
+
+
+class WeightCellsPool:
+    # every cell shares the same dout / clock pins, the active one is chosen with its WEIGHT_CELL register bit
+    def __init__(self, controller, dout_pin, clock_pin, settle_time=0.1):
+        self.controller = controller
+        self.dout_pin = dout_pin
+        self.clock_pin = clock_pin
+        self.settle_time = settle_time
+
+        self.sensors = {}
+        self.selected = None
+        self.selected_at = 0
+        self.settled = True
+        # time between selecting a cell and its first conversion, learned by module, settle_time is the first guess
+        self.settle_times = {}
+        # streaming filter of each cell, kept between reads
+        self.filters = {}
+        self.lock = controller.resources.get(EResource.WEIGHT_BUS)
+
+    def select(self, module):
+        if self.selected == module:
+            return False
+        with self.controller.transaction():
+            if self.selected is not None:
+                self.controller.set_weight_cell_state(self.selected, False)
+            self.controller.set_weight_cell_state(module, True)
+        self.selected = module
+        self.selected_at = time.monotonic()
+        self.settled = False
+        return True
+
+    def wait_settled(self, sensor):
+        # sleeps through most of the expected settle time, then polls DOUT for the first conversion
+        if self.settled:
+            return
+        expected = self.settle_times.get(self.selected, self.settle_time)
+        remaining = self.selected_at + expected * 0.8 - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        sensor.wait_ready()
+        measured = time.monotonic() - self.selected_at
+        self.settle_times[self.selected] = 0.7 * expected + 0.3 * measured
+        self.settled = True
+
+    def release(self):
+        with self.lock:
+            if self.selected is None:
+                return
+            self.controller.set_weight_cell_state(self.selected, False)
+            self.controller.send_states()
+            self.selected = None
+
+    def get_sensor(self, module):
+        sensor = self.sensors.get(module)
+        if sensor is None:
+            # the driver is only built once per cell, settling is handled by wait_settled()
+            sensor = HX711(self.dout_pin, self.clock_pin, gpio=self.controller.gpio, settle_time=0)
+            sensor.set_reading_format("MSB", "MSB")
+            self.sensors[module] = sensor
+
+        sm = StatesManager()
+        sensor.set_reference_unit_A(sm.get_weight_cell_reference_unit(module))
+        sensor.set_offset_A(sm.get_weight_cell_offset(module))
+        return sensor
+
+    def read_raw(self, module, times=10, tolerance=None, min_samples=3):
+        # with a tolerance (grams) sampling stops as soon as the standard error of the median is below it,
+        # times is then the max count
+        with self.lock:
+            self.select(module)
+            sensor = self.get_sensor(module)
+            self.wait_settled(sensor)
+            if tolerance is None:
+                return [sensor.read_long() for _ in range(times)]
+
+            tolerance = tolerance * abs(sensor.get_reference_unit_A())
+            values = []
+            while len(values) < times:
+                values.append(sensor.read_long())
+                if len(values) >= min_samples and median_standard_error(values) <= tolerance:
+                    break
+            return values
+
+    def standard_error(self, module, values):
+        # in grams
+        return median_standard_error(values) / abs(self.get_sensor(module).get_reference_unit_A())
+
+    def to_weight(self, module, values):
+        sensor = self.get_sensor(module)
+        return (statistics.median(values) - sensor.get_offset_A()) / sensor.get_reference_unit_A()
+
+    def get_filter(self, module):
+        f = self.filters.get(module)
+        if f is None:
+            f = make_filter(**StatesManager().get_weight_filter_settings())
+            self.filters[module] = f
+        return f
+
+    def reset_filter(self, module=None):
+        # the next samples of that cell (all cells if None) are not mixed with the previous ones
+        if module is None:
+            self.filters.clear()
+        else:
+            self.filters.pop(module, None)
+
+    def filtered_weight(self, module, values):
+        sensor = self.get_sensor(module)
+        f = self.get_filter(module)
+        for value in values:
+            f.update((value - sensor.get_offset_A()) / sensor.get_reference_unit_A())
+        return f.value
+
+    def read(self, module, times=10):
+        return self.to_weight(module, self.read_raw(module, times))
+
+    def tare(self, module, times=15, tolerance=None, min_samples=3):
+        # returns (offset, standard error in grams, samples taken)
+        with self.lock:
+            values = self.read_raw(module, times, tolerance, min_samples)
+            offset = statistics.median(values)
+            self.get_sensor(module).set_offset_A(offset)
+            self.reset_filter(module)
+            return offset, self.standard_error(module, values), len(values)
+
+    def close(self):
+        with self.lock:
+            self.release()
+            for sensor in self.sensors.values():
+                sensor.stop()
+            self.sensors.clear()
@@ -0,0 +1,149 @@
+import bisect
+import math
+import statistics
+from collections import deque
+
+
+class EFilter:
+    NONE = "none"
+    MEDIAN = "median"
+    EMA = "ema"
+    KALMAN = "kalman"
+
+
+def median_standard_error(values):
+    # robust standard error of the median : the spread is taken from the median absolute deviation,
+    # so a single glitch sample does not keep a read sampling until its max count
+    n = len(values)
+    if n < 2:
+        return math.inf
+    median = statistics.median(values)
+    sigma = 1.4826 * statistics.median(abs(v - median) for v in values)
+    return 1.2533 * sigma / math.sqrt(n)
+
+
+# every filter takes one sample at a time with update(), keeps its state between reads and gives its estimate with value
+
+
+class PassThroughFilter:
+    def __init__(self):
+        self.value = None
+
+    def update(self, sample):
+        self.value = sample
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class RunningMedianFilter:
+    # median of the last window samples, the sorted copy is kept up to date instead of sorting on every read
+    def __init__(self, window=5):
+        self.window = window
+        self.samples = deque()
+        self.sorted = []
+        self.value = None
+
+    def update(self, sample):
+        if len(self.samples) == self.window:
+            old = self.samples.popleft()
+            del self.sorted[bisect.bisect_left(self.sorted, old)]
+        self.samples.append(sample)
+        bisect.insort(self.sorted, sample)
+
+        n = len(self.sorted)
+        if n % 2:
+            self.value = self.sorted[n // 2]
+        else:
+            self.value = (self.sorted[n // 2 - 1] + self.sorted[n // 2]) / 2
+        return self.value
+
+    def reset(self):
+        self.samples.clear()
+        self.sorted = []
+        self.value = None
+
+
+class EmaFilter:
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, sample):
+        if self.value is None:
+            self.value = sample
+        else:
+            self.value += self.alpha * (sample - self.value)
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class KalmanFilter:
+    # constant weight model, process_noise lets the estimate follow slow changes (grams^2 per sample)
+    def __init__(self, process_noise=0.01, measurement_noise=0.25):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.value = None
+        self.variance = 0
+
+    def update(self, sample):
+        if self.value is None:
+            self.value = sample
+            self.variance = self.measurement_noise
+            return self.value
+        self.variance += self.process_noise
+        gain = self.variance / (self.variance + self.measurement_noise)
+        self.value += gain * (sample - self.value)
+        self.variance *= 1 - gain
+        return self.value
+
+    def reset(self):
+        self.value = None
+        self.variance = 0
+
+
+class OutlierRejector:
+    # drops samples further than threshold from the current estimate, unless max_rejects of them come in a row :
+    # then the weight really changed (bottle swapped, pour) and the filter restarts from the new value
+    def __init__(self, filter, threshold=50, max_rejects=3):
+        self.filter = filter
+        self.threshold = threshold
+        self.max_rejects = max_rejects
+        self.rejected = 0
+        self.rejected_total = 0
+
+    @property
+    def value(self):
+        return self.filter.value
+
+    def update(self, sample):
+        estimate = self.filter.value
+        if self.threshold > 0 and estimate is not None and abs(sample - estimate) > self.threshold:
+            self.rejected += 1
+            self.rejected_total += 1
+            if self.rejected < self.max_rejects:
+                return estimate
+            self.filter.reset()
+        self.rejected = 0
+        return self.filter.update(sample)
+
+    def reset(self):
+        self.rejected = 0
+        self.filter.reset()
+
+
+def make_filter(kind=EFilter.MEDIAN, window=5, alpha=0.3, process_noise=0.01, measurement_noise=0.25, outlier_threshold=50, outlier_max_rejects=3):
+    if kind == EFilter.MEDIAN:
+        f = RunningMedianFilter(window)
+    elif kind == EFilter.EMA:
+        f = EmaFilter(alpha)
+    elif kind == EFilter.KALMAN:
+        f = KalmanFilter(process_noise, measurement_noise)
+    elif kind == EFilter.NONE:
+        f = PassThroughFilter()
+    else:
+        raise ValueError(f"unknown weight filter : {kind}")
+    return OutlierRejector(f, outlier_threshold, outlier_max_rejects)
@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import deque
+
+from StatesManager import StatesManager
+
+
+class WeightSampler:
+    # cycles through the enabled cells in the background and keeps the last samples of each one
+    def __init__(self, controller, period=1.0, buffer_size=32, samples=3):
+        self.controller = controller
+        self.period = period
+        self.samples = samples
+
+        self.buffers = [deque(maxlen=buffer_size) for _ in range(controller.nb_modules)]
+        self.listeners = []
+
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def record(self, module, value, timestamp=None):
+        sample = (time.time() if timestamp is None else timestamp, value)
+        self.buffers[module].append(sample)
+        for listener in list(self.listeners):
+            listener(module, sample)
+
+    def latest(self, module):
+        buffer = self.buffers[module]
+        return buffer[-1] if buffer else None
+
+    def history(self, module):
+        return list(self.buffers[module])
+
+    def get_status(self):
+        now = time.time()
+        status = {}
+        for module in range(len(self.buffers)):
+            sample = self.latest(module)
+            if sample is None:
+                status[str(module)] = {"weight": None, "timestamp": None, "age": None}
+            else:
+                timestamp, value = sample
+                status[str(module)] = {"weight": value, "timestamp": timestamp, "age": now - timestamp}
+        return status
+
+    # region thread
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="WeightSampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            modules = [i for i in range(len(self.buffers)) if StatesManager().get_pump_enabled(i)]
+            # cells read by someone else during the last period are skipped
+            self.controller.weight_acquisition.refresh(modules, self.samples, self.period)
+            self.stop_event.wait(self.period)
+    # endregion
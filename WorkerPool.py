@@ -0,0 +1,50 @@
+import queue
+import threading
+import traceback
+
+
+class WorkerPool:
+    # fixed number of threads fed by a bounded queue, submit() refuses work instead of piling it up
+    def __init__(self, name, nb_workers, max_pending):
+        self.name = name
+        self.nb_workers = nb_workers
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.threads = []
+
+    def start(self):
+        if self.threads:
+            return
+        for i in range(self.nb_workers):
+            t = threading.Thread(target=self.run, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def submit(self, action, *args):
+        try:
+            self.queue.put_nowait((action, args))
+        except queue.Full:
+            return False
+        return True
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                action, args = job
+                action(*args)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,87 @@
+import threading
+from collections import deque
+
+from StatesManager import StatesManager
+
+
+class ZeroTracker:
+    # follows the slow drift of the load cells (temperature) without a blocking tare :
+    # while a bottle is not poured from its weight can't change, so when the cell has been stable for stable_time
+    # and reads a bit off the weight it settled at, the offset is moved back by at most max_step grams.
+    # A cell that settles within max_drift of 0 has nothing on it and is tracked against 0.
+    def __init__(self, controller, stable_time=30.0, band=0.5, max_drift=5.0, max_step=0.5, history_size=64):
+        self.controller = controller
+        self.stable_time = stable_time
+        self.band = band
+        self.max_drift = max_drift
+        self.max_step = max_step
+
+        nb_modules = controller.nb_modules
+        self.lock = threading.Lock()
+        self.windows = [deque() for _ in range(nb_modules)]
+        self.references = [None for _ in range(nb_modules)]
+        # offset correction since the last tare, in grams
+        self.drifts = [0.0 for _ in range(nb_modules)]
+        self.histories = [deque(maxlen=history_size) for _ in range(nb_modules)]
+
+    def invalidate(self, module):
+        # the weight of that cell may really change (pour, tare), the next stable weight becomes its reference
+        with self.lock:
+            self.windows[module].clear()
+            self.references[module] = None
+
+    def on_sample(self, module, sample):
+        timestamp, weight = sample
+        with self.lock:
+            window = self.windows[module]
+            window.append((timestamp, weight))
+            # keeps just enough samples to cover stable_time
+            while len(window) > 1 and timestamp - window[1][0] >= self.stable_time:
+                window.popleft()
+            if timestamp - window[0][0] < self.stable_time:
+                return
+            weights = [w for _, w in window]
+            if max(weights) - min(weights) > self.band:
+                return
+
+            mean = sum(weights) / len(weights)
+            window.clear()
+            reference = self.references[module]
+            if reference is None:
+                self.references[module] = 0.0 if abs(mean) <= self.max_drift else mean
+                reference = self.references[module]
+                if reference != 0.0:
+                    return
+
+            drift = mean - reference
+            if abs(drift) > self.max_drift:
+                # too far for a drift, something was put on or taken off the cell
+                self.references[module] = mean
+                return
+            if abs(drift) < self.band / 4:
+                # within the noise of the mean, not worth a correction
+                return
+            step = max(-self.max_step, min(self.max_step, drift))
+            self.drifts[module] += step
+            self.histories[module].append({"timestamp": timestamp, "step": step, "drift": self.drifts[module]})
+
+        self.correct(module, step)
+
+    def correct(self, module, step):
+        # (raw - offset) / reference_unit is the weight, moving the offset by step * reference_unit removes step grams
+        sm = StatesManager()
+        offset = sm.get_weight_cell_offset(module) + step * sm.get_weight_cell_reference_unit(module)
+        sm.set_weight_cell_offset(module, round(offset))
+
+    def reset_drift(self, module):
+        with self.lock:
+            self.drifts[module] = 0.0
+        self.invalidate(module)
+
+    def get_status(self):
+        with self.lock:
+            return {str(module): {
+                "reference": self.references[module],
+                "drift": self.drifts[module],
+                "history": list(self.histories[module]),
+            } for module in range(len(self.references))}
@@ -0,0 +1,120 @@
+# Runs against the simulated backend : python benchmark.py
+import json
+import os
+import shutil
+import tempfile
+import time
+
+os.environ.setdefault("GIBOTRON_BACKEND", "sim")
+
+from Hardware import get_backend, set_backend, SimulatedBackend
+from StatesManager import StatesManager
+from ModulesController import ModulesController
+import server
+
+
+class FakeWebsocketServer:
+    def __init__(self):
+        self.sent = 0
+
+    def send_message_to_all(self, message):
+        self.sent += 1
+
+    def send_message(self, client, message):
+        self.sent += 1
+
+
+def setup_states(flush_time=None, nb_modules=None):
+    # work on a copy, ModulesController writes back to the states file
+    path = os.path.join(tempfile.mkdtemp(), "states.json")
+    shutil.copy("states.json", path)
+    sm = StatesManager()
+    sm.states_file_path = path
+    sm.load_states()
+    if nb_modules is not None:
+        sm.set_nb_modules(nb_modules)
+        get_backend().world.resize(nb_modules)
+    for i in range(sm.get_nb_modules()):
+        sm.set_weight_cell_offset(i, get_backend().world.cells[i].offset)
+        sm.set_weight_cell_reference_unit(i, get_backend().world.cells[i].reference_unit)
+    sm.set_sampler_enabled(False)
+    if flush_time is not None:
+        sm.set_flush_time(flush_time)
+    return path
+
+
+def bench_blend(controller, data):
+    start = time.monotonic()
+    controller.blend(data, lambda status: None)
+    return time.monotonic() - start
+
+
+def bench_weight_read(controller, module=0, times=5):
+    start = time.monotonic()
+    for _ in range(times):
+        controller.read_weight(module)
+    return (time.monotonic() - start) / times
+
+
+def bench_protocol(controller, message, count=1000):
+    server.module_controller = controller
+    fake_server = FakeWebsocketServer()
+    packet = json.dumps(message)
+    start = time.monotonic()
+    for _ in range(count):
+        server.threat_message(None, fake_server, packet)
+    return count / (time.monotonic() - start)
+
+
+def bench_latch(controller, count=2000):
+    start = time.monotonic()
+    for i in range(count):
+        controller.set_valve_state(i % controller.nb_modules, i % 2 == 0)
+        controller.send_states()
+    return (time.monotonic() - start) / count
+
+
+def bench_scaling(sizes=(8, 16, 32, 64)):
+    # per latch cost and read_all_weights time against the module chain length
+    import ModulesController as modules_controller
+    debug_mode = modules_controller.DEBUG_MODE
+    modules_controller.DEBUG_MODE = False
+    try:
+        for nb_modules in sizes:
+            set_backend(SimulatedBackend(nb_modules))
+            path = setup_states(nb_modules=nb_modules)
+            controller = ModulesController()
+
+            latch = bench_latch(controller)
+            start = time.monotonic()
+            controller.read_all_weights()
+            read_all = time.monotonic() - start
+            print(f"{nb_modules} modules : latch {latch * 1e6:.1f} us, read_all_weights {read_all * 1000:.0f} ms")
+
+            controller.cleanup()
+            shutil.rmtree(os.path.dirname(path))
+    finally:
+        modules_controller.DEBUG_MODE = debug_mode
+
+
+def main():
+    path = setup_states(flush_time=0.5)
+    controller = ModulesController()
+
+    recipe = {"cup_size": 0.04, "ratios": {"0": 0.2, "1": 0.1, "2": 0.3, "3": 0.2, "4": 0.2}}
+    print(f"blend : {bench_blend(controller, recipe):.2f} s")
+    print(f"read_weight : {bench_weight_read(controller) * 1000:.1f} ms")
+    start = time.monotonic()
+    controller.read_all_weights()
+    print(f"read_all_weights : {(time.monotonic() - start) * 1000:.1f} ms")
+    print(f"protocol echo : {bench_protocol(controller, {'type': 'echo', 'data': {'msg': 'toaster'}}):.0f} msg/s")
+    print(f"protocol get_config : {bench_protocol(controller, {'type': 'get_config'}):.0f} msg/s")
+
+    controller.cleanup()
+    shutil.rmtree(os.path.dirname(path))
+
+    bench_scaling()
+
+
+if __name__ == '__main__':
+    main()
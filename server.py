@@ -3,10 +3,11 @@ import logging
 import atexit
 
 from websocket_server import WebsocketServer
-from threading import Thread
 
 from ModulesController import ModulesController
 from StatesManager import StatesManager
+from WorkerPool import WorkerPool
+from OrdersQueue import OrdersQueue, EOrderState
 
 
 class BlendAction:
@@ -18,14 +19,47 @@ class BlendAction:
 ADDR = "0.0.0.0"
 PORT = 8765
 
+# weight cell actions go through a single worker, in arrival order. Blends run on the orders queue thread,
+# both only wait for the hardware they share (see ResourceManager)
+HARDWARE_MESSAGE_TYPES = {
+    'tare_cell', 'tare_all_cell',
+    'read_weight', 'read_all_weights',
+    'read_dout',
+}
+NB_WORKERS = 4
+MAX_PENDING_MESSAGES = 64
+MAX_PENDING_HARDWARE_ACTIONS = 8
+
+worker_pool = WorkerPool("worker", NB_WORKERS, MAX_PENDING_MESSAGES)
+hardware_queue = WorkerPool("hardware", 1, MAX_PENDING_HARDWARE_ACTIONS)
+orders_queue = None
+
 current_action = BlendAction.Idle
 
+# clients that receive every new weight sample, by client id
+weight_subscribers = {}
+
 
 def new_client(client, server):
     print("hi !")
     print(client)
 
 
+def client_left(client, server):
+    if client is not None:
+        weight_subscribers.pop(client['id'], None)
+
+
+def send_weight_sample(server, module, sample):
+    timestamp, value = sample
+    payload = json.dumps({
+        'type': 'weight',
+        'data': {"pump_index": module, "weight": value, "timestamp": timestamp}
+    })
+    for client in list(weight_subscribers.values()):
+        server.send_message(client, payload)
+
+
 def send_message(server, msg_type, data):
     server.send_message_to_all(json.dumps({
         'type': msg_type,
@@ -33,27 +67,36 @@ def send_message(server, msg_type, data):
     }))
 
 
+def send_json_message(server, msg_type, json_data):
+    # data is already serialized, e.g. a cached config snapshot
+    server.send_message_to_all('{"type": %s, "data": %s}' % (json.dumps(msg_type), json_data))
+
+
 def thread_threat_message(client, server, message):
-    t = Thread(target=threat_message, args=[client, server, message])
-    t.start()
+    try:
+        packet = json.loads(message)
+        message_type = packet['type']
+    except (ValueError, KeyError, TypeError):
+        send_message(server, 'error', {'msg': 'Invalid message'})
+        return
 
+    pool = hardware_queue if message_type in HARDWARE_MESSAGE_TYPES else worker_pool
+    if not pool.submit(threat_packet, client, server, packet):
+        send_message(server, 'overloaded', {'message_type': message_type, 'queue': pool.name, 'depth': pool.depth()})
 
-def if_not_busy(server, action, data=None, callback=None):
-    if module_controller.remaining_blend_time > 0:
-        send_message(server, 'error', {'msg': f'Busy ! Retry in {module_controller.remaining_blend_time} sec'})
-    else:
-        if callback:
-            return action(data, callback)
-        else:
-            if data is not None:
-                print("la !!!")
-                return action(data)
-            else:
-                return action()
+
+def on_order_change(server, order):
+    send_message(server, 'order', order)
+    if order['state'] == EOrderState.DONE:
+        # the pour taught the calibration something, recompile the recipes it touched before they are served again
+        worker_pool.submit(module_controller.recipes.refresh)
 
 
 def threat_message(client, server, message):
-    packet = json.loads(message)
+    threat_packet(client, server, json.loads(message))
+
+
+def threat_packet(client, server, packet):
     message_type = packet['type']
     # print(f"Recv {message_type} : {packet['data']}")
 
@@ -66,61 +109,152 @@ def threat_message(client, server, message):
     if message_type == 'echo':
         send_message(server, 'echo', packet)
 
-    elif message_type == 'blend':
-        if_not_busy(server, module_controller.blend, packet['data'], callback)
-    elif message_type == 'faster_blend':
-        if_not_busy(server, module_controller.faster_blend, packet['data'], callback)
+    elif message_type in ('blend', 'faster_blend', 'batch_blend'):
+        try:
+            module_controller.validate_blend(packet.get('data'), message_type)
+        except ValueError as e:
+            send_message(server, 'error', {'msg': f'Invalid blend : {e}'})
+            return
+        order = orders_queue.add(message_type, packet['data'])
+        send_message(server, 'order', orders_queue.get_eta(order['id']) or order)
+    elif message_type == 'estimate_blend':
+        try:
+            module_controller.validate_blend(packet.get('data'))
+        except ValueError as e:
+            send_message(server, 'error', {'msg': f'Invalid blend : {e}'})
+            return
+        send_message(server, 'blend_estimate', module_controller.describe_blend(packet['data']))
+    elif message_type == 'cup_ready':
+        module_controller.cup_ready()
+    elif message_type == 'serve_recipe':
+        name = packet['data']['name']
+        recipe = module_controller.recipes.get(name)
+        if recipe is None:
+            send_message(server, 'error', {'msg': f'Unknown recipe {name}'})
+            return
+        disabled = module_controller.recipes.disabled_modules(recipe)
+        if disabled:
+            send_message(server, 'error', {'msg': f'Recipe {name} needs disabled pumps {disabled}'})
+            return
+        cups = packet['data'].get('cups', 1)
+        data = module_controller.recipes.to_blend_data(recipe)
+        try:
+            module_controller.validate_blend(dict(data, cups=cups))
+        except ValueError as e:
+            send_message(server, 'error', {'msg': f'Invalid order of {name} : {e}'})
+            return
+        if cups > 1:
+            order = orders_queue.add('batch_blend', dict(data, cups=cups))
+        else:
+            order = orders_queue.add('blend', data)
+        send_message(server, 'order', orders_queue.get_eta(order['id']) or order)
+    elif message_type == 'create_recipe':
+        data = packet['data']
+        try:
+            module_controller.recipes.create(data['name'], data.get('ratios'), data.get('cup_size'), data.get('dosing'))
+        except ValueError as e:
+            send_message(server, 'error', {'msg': f"Invalid recipe {data['name']} : {e}"})
+            return
+        send_message(server, 'recipes', module_controller.recipes.list())
+    elif message_type == 'delete_recipe':
+        name = packet['data']['name']
+        if not module_controller.recipes.delete(name):
+            send_message(server, 'error', {'msg': f'Unknown recipe {name}'})
+        send_message(server, 'recipes', module_controller.recipes.list())
+    elif message_type == 'list_recipes':
+        send_message(server, 'recipes', module_controller.recipes.list())
+
+    elif message_type == 'list_orders':
+        send_message(server, 'orders', orders_queue.list())
+    elif message_type == 'cancel_order':
+        order_id = packet['data']['order_id']
+        if not orders_queue.cancel(order_id):
+            send_message(server, 'error', {'msg': f'Order {order_id} is not pending'})
+        send_message(server, 'orders', orders_queue.list())
+    elif message_type == 'move_order':
+        order_id = packet['data']['order_id']
+        if not orders_queue.move(order_id, packet['data']['position']):
+            send_message(server, 'error', {'msg': f'Order {order_id} is not pending'})
+        send_message(server, 'orders', orders_queue.list())
     elif message_type == "get_blend_status":
-        send_message(server, 'status', {"initial_time": module_controller.initial_blend_time, "remaining_time": module_controller.remaining_blend_time})
+        send_message(server, 'status', module_controller.get_blend_status())
 
     elif message_type == "get_pumps_states":
         print("ok")
-        send_message(server, 'pumps_states', StatesManager().get_all_full_pump_states())
+        send_json_message(server, 'pumps_states', StatesManager().get_all_full_pump_states_json())
     elif message_type == "set_pump_state":
         pump_index = packet['data']['pump_index']
         state = packet['data']['state']
         StatesManager().set_pump_enabled(pump_index, state)
 
-        send_message(server, 'pumps_states', StatesManager().get_all_full_pump_states())
+        send_json_message(server, 'pumps_states', StatesManager().get_all_full_pump_states_json())
     elif message_type == "set_sec_per_liter":
         sec_per_liter = packet['data']['sec_per_liter']
         StatesManager().set_sec_per_liter(sec_per_liter)
         send_message(server, 'sec_per_liter', StatesManager().get_sec_per_liter())
+    elif message_type == "reset_calibration":
+        pump_index = packet['data']['pump_index']
+        module_controller.reset_calibration(pump_index)
+        send_json_message(server, 'config', StatesManager().get_config_json())
+    elif message_type == "set_max_concurrent_pumps":
+        max_concurrent_pumps = packet['data']['max_concurrent_pumps']
+        StatesManager().set_max_concurrent_pumps(max_concurrent_pumps)
+        send_json_message(server, 'config', StatesManager().get_config_json())
     elif message_type == "get_config":
-        send_message(server, 'config', StatesManager().states)
+        send_json_message(server, 'config', StatesManager().get_config_json())
 
     elif message_type == "set_pump_speed_ratio":
         pump_index = packet['data']['pump_index']
         speed_ratio = packet['data']['speed_ratio']
         StatesManager().set_pump_speed_ratio(pump_index, speed_ratio)
-        send_message(server, 'config', StatesManager().states)
+        send_json_message(server, 'config', StatesManager().get_config_json())
+
+    elif message_type == "set_pump_flush_time":
+        pump_index = packet['data']['pump_index']
+        StatesManager().set_pump_flush_time(pump_index, packet['data'].get('flush_time'))
+        send_json_message(server, 'config', StatesManager().get_config_json())
+    elif message_type == "set_pump_liquid":
+        pump_index = packet['data']['pump_index']
+        StatesManager().set_pump_liquid(pump_index, packet['data'].get('liquid'))
+        send_json_message(server, 'config', StatesManager().get_config_json())
+    elif message_type == "get_line_states":
+        send_message(server, "line_states", module_controller.get_line_states())
 
     elif message_type == "tare_cell":
         pump_index = packet['data']['pump_index']
-        ok = if_not_busy(server, module_controller.tare_weight_cell, pump_index)
-        if ok:
-            send_message(server, "tare_cell", {"pump_index": pump_index})
+        result = module_controller.tare_weight_cell(pump_index)
+        if result:
+            send_message(server, "tare_cell", dict(result, pump_index=pump_index))
         else:
-            send_message(server, "tare_cell_failed", {"pump_index": pump_index})
+            send_message(server, "tare_cell_failed", {"pump_index": pump_index, "busy": result is None})
     elif message_type == "tare_all_cell":
-        ok = if_not_busy(server, module_controller.tare_all_cells)
-        if ok:
-            send_message(server, "tare_all_cell", {})
+        busy = module_controller.tare_all_cells()
+        send_message(server, "tare_all_cell", {"busy": busy})
 
     elif message_type == "read_weight":
         pump_index = packet['data']['pump_index']
-        ok = if_not_busy(server, module_controller.read_weight, pump_index)
-        if ok:
-            send_message(server, "read_weight", {"pump_index": pump_index})
+        result = module_controller.read_weight(pump_index)
+        if result:
+            send_message(server, "read_weight", dict(result, pump_index=pump_index))
+        else:
+            send_message(server, "error", {"msg": f"Weight cell {pump_index} is not responding"})
     elif message_type == "read_all_weights":
-        ok = if_not_busy(server, module_controller.read_all_weights)
+        max_age = (packet.get('data') or {}).get('max_age')
+        ok = module_controller.read_all_weights(max_age)
         if ok:
             send_message(server, "read_all_weights", {})
 
     elif message_type == "get_all_weights":
-        weights = if_not_busy(server, module_controller.get_all_weights)
-        if weights:
-            send_message(server, "get_all_weights", weights)
+        send_message(server, "get_all_weights", module_controller.get_all_weights())
+
+    elif message_type == "get_zero_tracking":
+        send_message(server, "zero_tracking", module_controller.get_zero_tracking())
+
+    elif message_type == "subscribe_weights":
+        weight_subscribers[client['id']] = client
+        send_message(server, "get_all_weights", module_controller.get_all_weights())
+    elif message_type == "unsubscribe_weights":
+        weight_subscribers.pop(client['id'], None)
 
     elif message_type == "read_dout":
         module_controller.read_dout()
@@ -133,11 +267,29 @@ def main():
     print("ready")
     server = WebsocketServer(host=ADDR, port=PORT, loglevel=logging.INFO)
     server.set_fn_new_client(new_client)
+    server.set_fn_client_left(client_left)
+    module_controller.weight_sampler.add_listener(lambda module, sample: send_weight_sample(server, module, sample))
     server.set_fn_message_received(thread_threat_message)
+    worker_pool.start()
+    hardware_queue.start()
+
+    global orders_queue
+    orders_queue = OrdersQueue(
+        module_controller, lambda action: action(),
+        on_change=lambda order: on_order_change(server, order),
+        on_status=lambda status: send_message(server, 'status', status),
+    )
+    orders_queue.load()
+    orders_queue.start()
+
     server.run_forever()
 
 
-module_controller = ModulesController()
-atexit.register(module_controller.cleanup)
+if __name__ == '__main__':
+    StatesManager().enable_write_behind()
+    atexit.register(StatesManager().flush)
+
+    module_controller = ModulesController()
+    atexit.register(module_controller.cleanup)
 
-main()
+    main()
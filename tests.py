@@ -1,15 +1,17 @@
 import time
 
-from RPi import GPIO
-
 from HX711_2 import HX711
-import RPi.GPIO as gpio
+from Hardware import get_backend
 
 from ModulesController import ModulesController
 
+gpio = get_backend().gpio
+GPIO = gpio
+
 
 def aatest_cell():
     gpio.setmode(gpio.BCM)
+    get_backend().attach_hx711(9, 11)
     cell = HX711(9, 11)
 
     # cell.set_scale(87834)
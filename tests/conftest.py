@@ -0,0 +1,60 @@
+import os
+import shutil
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("GIBOTRON_BACKEND", "sim")
+
+from StatesManager import StatesManager
+
+
+@contextmanager
+def states_copy(directory):
+    # StatesManager on a copy of states.json, setters write to the copy
+    path = os.path.join(directory, "states.json")
+    shutil.copy(os.path.join(ROOT, "states.json"), path)
+    sm = StatesManager()
+    previous = sm.states_file_path
+    sm.states_file_path = path
+    sm.load_states()
+    try:
+        yield sm
+    finally:
+        sm.states_file_path = previous
+        sm.load_states()
+
+
+@pytest.fixture
+def states(tmp_path):
+    with states_copy(str(tmp_path)) as sm:
+        yield sm
+
+
+@pytest.fixture(scope="module")
+def controller(tmp_path_factory):
+    # ModulesController on the simulated backend, shared by the tests of a file (it takes a second to start),
+    # recipes.json and the states copy live in a temporary directory
+    from Hardware import get_backend
+    import ModulesController
+
+    directory = str(tmp_path_factory.mktemp("controller"))
+    cwd = os.getcwd()
+    debug_mode = ModulesController.DEBUG_MODE
+    with states_copy(directory) as sm:
+        os.chdir(directory)
+        ModulesController.DEBUG_MODE = False
+        try:
+            sm.set_sampler_enabled(False)
+            for i, cell in enumerate(get_backend().world.cells[:sm.get_nb_modules()]):
+                sm.set_weight_cell_offset(i, cell.offset)
+                sm.set_weight_cell_reference_unit(i, cell.reference_unit)
+            controller = ModulesController.ModulesController()
+            yield controller
+            controller.cleanup()
+        finally:
+            ModulesController.DEBUG_MODE = debug_mode
+            os.chdir(cwd)
@@ -0,0 +1,107 @@
+import itertools
+import random
+
+import pytest
+
+from BlendScheduler import BlendScheduler, EStep, Pour
+
+
+def random_pours(rng, count, modules=range(8)):
+    return [
+        Pour(module, rng.choice([0, rng.uniform(0.2, 3)]), rng.choice([0, 0, rng.uniform(0.5, 3)]),
+             rng.choice([0, rng.uniform(0.2, 2)]), rng.choice([0, rng.uniform(0.2, 2)]))
+        for module in rng.sample(list(modules), count)
+    ]
+
+
+def max_running_pumps(steps):
+    # the number of running pumps only goes up when a step starts
+    return max((sum(1 for s in steps if s.uses_pump and s.start <= t < s.end)
+                for t in (s.start for s in steps if s.uses_pump)), default=0)
+
+
+def assert_chains_in_order(steps):
+    # flush before, pour, transit, flush after : one at a time and in that order on each module
+    by_module = {}
+    for step in sorted(steps, key=lambda s: s.start):
+        by_module.setdefault(step.module, []).append(step)
+    for module_steps in by_module.values():
+        for previous, step in zip(module_steps, module_steps[1:]):
+            assert step.start >= previous.end - 1e-9
+
+
+def test_make_chains_skips_empty_steps():
+    scheduler = BlendScheduler(4)
+    chain, = scheduler.make_chains([Pour(3, 1.5, 0, 0, 2)])
+    assert [(s.module, s.kind, s.duration) for s in chain] == [(3, EStep.POUR, 1.5), (3, EStep.FLUSH, 2)]
+
+
+def test_flush_after_waits_for_the_line():
+    steps = BlendScheduler(4).schedule([Pour(0, 1, 2, 1, 1)])
+    assert [(s.kind, s.start, s.end) for s in steps] == [
+        (EStep.FLUSH, 0, 1), (EStep.POUR, 1, 2), (EStep.TRANSIT, 2, 4), (EStep.FLUSH, 4, 5),
+    ]
+
+
+@pytest.mark.parametrize("max_pumps", [1, 2, 3, 4])
+def test_schedule_respects_pump_budget(max_pumps):
+    rng = random.Random(max_pumps)
+    scheduler = BlendScheduler(max_pumps)
+    for _ in range(50):
+        steps = scheduler.optimize(random_pours(rng, rng.randint(1, 7)))
+        assert max_running_pumps(steps) <= max_pumps
+        assert_chains_in_order(steps)
+
+
+@pytest.mark.parametrize("max_pumps", [1, 2, 3])
+def test_optimize_is_optimal_up_to_five_pours(max_pumps):
+    rng = random.Random(10 + max_pumps)
+    scheduler = BlendScheduler(max_pumps)
+    for _ in range(30):
+        pours = random_pours(rng, rng.randint(1, 5))
+        best = min(BlendScheduler.total_time(scheduler.schedule(order)) for order in itertools.permutations(pours))
+        assert BlendScheduler.total_time(scheduler.optimize(pours)) == pytest.approx(best)
+
+
+def test_optimize_is_deterministic():
+    rng = random.Random(3)
+    pours = random_pours(rng, 7)
+    scheduler = BlendScheduler(2)
+    first = [(s.module, s.kind, s.start) for s in scheduler.optimize(pours)]
+    assert first == [(s.module, s.kind, s.start) for s in scheduler.optimize(list(pours))]
+
+
+def test_long_transit_goes_first():
+    # the pump is free again while the liquid of module 0 travels, pouring it first hides that delay
+    pours = [Pour(1, 1, 0, 0, 0), Pour(0, 1, 5, 0, 0)]
+    steps = BlendScheduler(1).optimize(pours)
+    assert BlendScheduler.total_time(steps) == pytest.approx(6)
+
+
+@pytest.mark.parametrize("max_pumps", [1, 2, 3, 4])
+def test_fill_respects_pump_budget_and_deadline(max_pumps):
+    rng = random.Random(100 + max_pumps)
+    scheduler = BlendScheduler(max_pumps)
+    for _ in range(50):
+        count = rng.randint(1, 4)
+        modules = list(range(8))
+        rng.shuffle(modules)
+        steps = scheduler.optimize(random_pours(rng, count, modules[:count]))
+        deadline = BlendScheduler.total_time(steps)
+        before = [(s.module, s.kind, s.start) for s in steps]
+
+        extra = [Pour(module, 0, 0, rng.uniform(0.2, 2), 0) for module in modules[count:count + rng.randint(1, 4)]]
+        placed = scheduler.fill(steps, extra, deadline)
+
+        # the plan itself never moves, what was added fits in its idle pumps and before it ends
+        assert [(s.module, s.kind, s.start) for s in steps] == before
+        assert max_running_pumps(steps + placed) <= max_pumps
+        assert all(s.end <= deadline + 1e-9 for s in placed)
+        assert {s.module for s in placed} <= {p.module for p in extra}
+
+
+def test_fill_uses_idle_pumps():
+    scheduler = BlendScheduler(2)
+    steps = scheduler.schedule([Pour(0, 3, 0, 0, 0)])
+    placed = scheduler.fill(steps, [Pour(1, 0, 0, 1, 0), Pour(2, 0, 0, 1, 0), Pour(3, 0, 0, 5, 0)], 3)
+    assert [(s.module, s.start) for s in placed] == [(1, 0), (2, 1)]
@@ -0,0 +1,40 @@
+import pytest
+
+from BlendTimeline import Timeline, TimelineExecutor
+
+
+def test_compile_merges_changes_at_the_same_offset():
+    timeline = Timeline.compile([(0, 0, True), (0, 9, True), (1, 0, False), (2, 9, False)])
+    assert timeline.changes == [(0, (0b1000000001, 0)), (1, (0, 0b1)), (2, (0, 0b1000000000))]
+
+
+def test_compile_off_and_on_at_the_same_offset_stays_on():
+    # a flush ending right when the pour of the same bit starts, e.g. two steps sharing a valve
+    timeline = Timeline.compile([(0, 3, True), (1, 3, False), (1, 3, True), (2, 3, False)])
+    assert timeline.changes == [(0, (0b1000, 0)), (1, (0b1000, 0)), (2, (0, 0b1000))]
+
+
+def test_compile_total_time():
+    entries = [(0, 1, True), (1.5, 1, False)]
+    assert Timeline.compile(entries).total_time == 1.5
+    # liquid still travelling down the line after the last change
+    assert Timeline.compile(entries, 4).total_time == 4
+    assert Timeline.compile([], 2).total_time == 2
+
+
+def test_on_mask():
+    timeline = Timeline.compile([(0, 1, True), (0.5, 4, True), (1, 1, False), (2, 4, False)])
+    assert timeline.on_mask == 0b10010
+
+
+def test_executor_applies_every_change_in_order():
+    applied = []
+    progress = []
+    executor = TimelineExecutor(applied.append, status_period=0.01)
+    timeline = Timeline.compile([(0, 0, True), (0.02, 1, True), (0.04, 0, False), (0.04, 1, False)], 0.05)
+
+    duration = executor.run(timeline, progress.append)
+
+    assert applied == [(0b1, 0), (0b10, 0), (0, 0b11)]
+    assert duration == pytest.approx(0.05, abs=0.02)
+    assert progress[-1] == timeline.total_time
@@ -0,0 +1,76 @@
+import pytest
+
+from BlendScheduler import Step, EStep
+from LineTracker import LineTracker, ELine
+
+
+@pytest.fixture
+def lines(states):
+    states.set_flush_time(3)
+    states.set_global("flush_clean_validity", 600)
+    states.set_global("flush_primed_validity", 300)
+    states.set_global("flush_rinse_ratio", 0.5)
+    states.set_flush_keep_primed(False)
+    return LineTracker(states.get_nb_modules())
+
+
+def step(module, kind, start, duration):
+    s = Step(module, kind, duration)
+    s.start = start
+    return s
+
+
+def test_unknown_line_is_fully_flushed(lines):
+    assert lines.pre_flush_time(0) == 3
+    assert lines.post_flush_time(0) == 3
+
+
+def test_pump_flush_time_overrides_the_global_one(lines, states):
+    states.set_pump_flush_time(1, 5)
+    assert lines.pre_flush_time(1) == 5
+    states.set_pump_flush_time(1, None)
+    assert lines.pre_flush_time(1) == 3
+
+
+def test_clean_line(lines):
+    lines.mark_flushed(0, at=1000)
+    assert lines.pre_flush_time(0, now=1000 + 599) == 0
+    # flushed too long ago : only rinsed
+    assert lines.pre_flush_time(0, now=1000 + 601) == pytest.approx(1.5)
+
+
+def test_primed_line(lines, states):
+    states.set_pump_liquid(0, "rum")
+    lines.mark_primed(0, at=1000)
+    assert lines.pre_flush_time(0, now=1000 + 299) == 0
+    assert lines.pre_flush_time(0, now=1000 + 301) == 3
+
+    # another bottle on that pump
+    states.set_pump_liquid(0, "gin")
+    assert lines.pre_flush_time(0, now=1000 + 1) == 3
+
+
+def test_keep_primed_skips_the_post_flush(lines, states):
+    states.set_flush_keep_primed(True)
+    assert lines.post_flush_time(0) == 0
+
+
+def test_invalidate(lines):
+    lines.mark_flushed(2)
+    lines.invalidate([2])
+    assert lines.get_status()["2"]["state"] == ELine.UNKNOWN
+    assert lines.pre_flush_time(2) == 3
+
+
+def test_record(lines):
+    steps = [
+        step(0, EStep.FLUSH, 0, 1), step(0, EStep.POUR, 1, 2), step(0, EStep.TRANSIT, 3, 1), step(0, EStep.FLUSH, 4, 1),
+        step(1, EStep.POUR, 0, 2),
+    ]
+    lines.record(steps, start=1000)
+    status = lines.get_status()
+    assert status["0"]["state"] == ELine.CLEAN
+    assert status["1"]["state"] == ELine.PRIMED
+    assert status["2"]["state"] == ELine.UNKNOWN
+    assert lines.lines[0]["since"] == 1005
+    assert lines.lines[1]["since"] == 1002
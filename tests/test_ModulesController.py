@@ -0,0 +1,44 @@
+import pytest
+
+
+BLEND = {"ratios": {"0": 0.5, "3": 0.5}, "cup_size": 0.04}
+
+
+def test_validate_blend_accepts_a_blend(controller):
+    controller.validate_blend(BLEND)
+    controller.validate_blend(dict(BLEND, dosing="gravimetric", cups=3))
+
+
+@pytest.mark.parametrize("data", [
+    None,
+    {"cup_size": 0.04},
+    dict(BLEND, ratios={}),
+    dict(BLEND, ratios={"a": 1}),
+    dict(BLEND, ratios={"42": 1}),
+    dict(BLEND, ratios={"0": "1"}),
+    dict(BLEND, ratios={"0": True}),
+    dict(BLEND, ratios={"0": -0.5}),
+    dict(BLEND, ratios={"1": 0.5, "01": 0.5}),
+    dict(BLEND, cup_size=0),
+    {"ratios": {"0": 1}},
+    dict(BLEND, dosing="by eye"),
+    dict(BLEND, cups=0),
+    dict(BLEND, cups="2"),
+])
+def test_validate_blend_rejects(controller, data):
+    with pytest.raises(ValueError):
+        controller.validate_blend(data)
+
+
+def test_batch_blend_needs_cups(controller):
+    with pytest.raises(ValueError):
+        controller.validate_blend(BLEND, 'batch_blend')
+    controller.validate_blend(dict(BLEND, cups=2), 'batch_blend')
+
+
+@pytest.mark.parametrize("action", ['blend', 'faster_blend'])
+def test_blend_pours_one_cup(controller, action):
+    controller.validate_blend(BLEND, action)
+    controller.validate_blend(dict(BLEND, cups=1), action)
+    with pytest.raises(ValueError):
+        controller.validate_blend(dict(BLEND, cups=3), action)
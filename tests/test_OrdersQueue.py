@@ -0,0 +1,140 @@
+import threading
+
+import pytest
+
+from OrdersQueue import OrdersQueue, EOrderState
+
+
+class FakeController:
+    def __init__(self):
+        self.poured = []
+        self.next_blend = None
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def estimate_blend_time(self, data):
+        if data.get("broken"):
+            raise IndexError("no such module")
+        return data["time"]
+
+    def blend(self, data, status_callback):
+        self.started.set()
+        self.release.wait(5)
+        if data.get("fail"):
+            raise RuntimeError("pump jammed")
+        self.poured.append(data["time"])
+
+
+@pytest.fixture
+def queue_file(tmp_path):
+    return str(tmp_path / "orders.json")
+
+
+def make_queue(queue_file, controller=None, changes=None):
+    # the queue keeps updating the order dicts, only their state at the time of the change is recorded
+    on_change = None if changes is None else (lambda order: changes.append((order["id"], order["state"])))
+    return OrdersQueue(controller or FakeController(), lambda action: action(), file_path=queue_file, on_change=on_change)
+
+
+def wait_finished(changes, count):
+    for _ in range(500):
+        if sum(state in (EOrderState.DONE, EOrderState.FAILED) for _, state in changes) >= count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("orders did not finish")
+
+
+def test_orders_run_in_order(queue_file):
+    controller = FakeController()
+    changes = []
+    queue = make_queue(queue_file, controller, changes)
+    queue.add("blend", {"time": 1})
+    queue.add("blend", {"time": 2})
+    queue.start()
+    wait_finished(changes, 2)
+    queue.stop()
+    assert controller.poured == [1, 2]
+    assert changes[2:] == [(1, EOrderState.RUNNING), (1, EOrderState.DONE), (2, EOrderState.RUNNING), (2, EOrderState.DONE)]
+    assert queue.list() == []
+
+
+def test_failed_order_does_not_stop_the_queue(queue_file):
+    controller = FakeController()
+    changes = []
+    queue = make_queue(queue_file, controller, changes)
+    queue.add("blend", {"time": 1, "fail": True})
+    queue.add("blend", {"time": 2})
+    queue.start()
+    wait_finished(changes, 2)
+    queue.stop()
+    assert controller.poured == [2]
+    assert changes[3] == (1, EOrderState.FAILED)
+
+
+def test_pending_orders_survive_a_restart(queue_file):
+    queue = make_queue(queue_file)
+    first = queue.add("blend", {"time": 1})
+    queue.add("blend", {"time": 2})
+    queue.cancel(first["id"])
+
+    restarted = make_queue(queue_file)
+    restarted.load()
+    assert [(order["data"]["time"], order["state"]) for order in restarted.list()] == [(2, EOrderState.PENDING)]
+    # ids keep counting from where they were
+    assert restarted.add("blend", {"time": 3})["id"] == 3
+
+
+def test_running_order_is_interrupted_not_replayed(queue_file):
+    controller = FakeController()
+    controller.release.clear()
+    queue = make_queue(queue_file, controller)
+    running = queue.add("blend", {"time": 1})
+    queue.add("blend", {"time": 2})
+    queue.start()
+    assert controller.started.wait(5)
+
+    # the server stops while the first order pours
+    restarted = make_queue(queue_file)
+    restarted.load()
+    controller.release.set()
+    queue.stop()
+
+    orders = restarted.list()
+    assert [(order["id"], order["state"]) for order in orders] == [(running["id"], EOrderState.INTERRUPTED), (2, EOrderState.PENDING)]
+    assert orders[0]["eta_start"] is None
+
+    # still there after another restart, until cancelled
+    restarted.save()
+    again = make_queue(queue_file)
+    again.load()
+    assert again.find(running["id"])["state"] == EOrderState.INTERRUPTED
+    assert not again.move(running["id"], 1)
+    assert again.cancel(running["id"])
+    assert [order["id"] for order in again.list()] == [2]
+
+
+def test_list_survives_an_order_that_cant_be_estimated(queue_file):
+    queue = make_queue(queue_file)
+    queue.add("blend", {"broken": True})
+    queue.add("blend", {"time": 2})
+    orders = queue.list()
+    assert [order["eta_finish"] for order in orders] == [None, None]
+
+
+def test_eta(queue_file):
+    queue = make_queue(queue_file)
+    queue.add("blend", {"time": 2})
+    second = queue.add("blend", {"time": 3})
+    eta = queue.get_eta(second["id"])
+    assert eta["eta_finish"] - eta["eta_start"] == pytest.approx(3)
+
+
+def test_peek_and_move(queue_file):
+    controller = FakeController()
+    queue = make_queue(queue_file, controller)
+    queue.add("blend", {"time": 1})
+    second = queue.add("blend", {"time": 2})
+    assert queue.peek() == {"time": 1}
+    assert queue.move(second["id"], 0)
+    assert queue.peek() == {"time": 2}
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from PumpCalibration import PumpCalibration
+
+
+def calibrated(rate=10.0, intercept=1.0, times=(1, 2, 3, 1.5, 2.5)):
+    calibration = PumpCalibration()
+    for pump_time in times:
+        assert calibration.add(pump_time, rate * pump_time + intercept)
+    return calibration
+
+
+def test_fit():
+    calibration = calibrated()
+    assert calibration.is_ready()
+    assert calibration.rate() == pytest.approx(10)
+    assert calibration.intercept() == pytest.approx(1)
+    assert calibration.pump_time(21) == pytest.approx(2)
+
+
+def test_not_ready_before_min_samples():
+    calibration = PumpCalibration(min_samples=3)
+    calibration.add(1, 10)
+    calibration.add(2, 20)
+    assert not calibration.is_ready()
+
+
+def test_outlier_is_rejected_and_does_not_move_the_fit():
+    calibration = calibrated()
+    rate, intercept = calibration.rate(), calibration.intercept()
+
+    # a bottle knocked over during the pour, or a cell glitch
+    assert not calibration.add(2, 60)
+    assert calibration.rejected == 1
+    assert calibration.rate() == pytest.approx(rate)
+    assert calibration.intercept() == pytest.approx(intercept)
+
+
+def test_nothing_poured_is_always_rejected():
+    calibration = PumpCalibration()
+    assert not calibration.add(1, 0)
+    assert not calibration.add(0, 10)
+    assert calibration.count == 0
+    assert calibration.rejected == 2
+
+
+def test_values_before_ready_are_not_outliers():
+    # nothing to compare with yet
+    calibration = PumpCalibration()
+    assert calibration.add(1, 10)
+    assert calibration.add(1, 30)
+
+
+def test_round_trip():
+    calibration = calibrated()
+    restored = PumpCalibration(calibration.to_dict())
+    assert restored.count == calibration.count
+    assert restored.rate() == pytest.approx(calibration.rate())
+    assert restored.intercept() == pytest.approx(calibration.intercept())
+
+
+def test_clustered_pump_times_fit_through_the_origin():
+    # the same cocktail all night : each pour time comes from the previous fit, so they barely move
+    rng = random.Random(7)
+    rate = 11.1
+    calibration = PumpCalibration()
+    for _ in range(30):
+        pump_time = calibration.pump_time(40) if calibration.is_ready() else 3.6
+        pump_time += rng.uniform(-0.02, 0.02)
+        calibration.add(pump_time, rate * pump_time + rng.gauss(0, rng.uniform(0.3, 1)))
+
+    assert calibration.spread() < calibration.min_spread
+    assert calibration.intercept() == 0
+    assert calibration.rate() == pytest.approx(rate, rel=0.03)
+    # far from the learned pour times too
+    assert calibration.pump_time(10) == pytest.approx(10 / rate, rel=0.05)
+    assert calibration.pump_time(80) == pytest.approx(80 / rate, rel=0.05)
+
+
+def test_spread_pump_times_fit_the_intercept():
+    calibration = calibrated(times=(0.5, 1, 2, 3, 4))
+    assert calibration.spread() >= calibration.min_spread
+    assert calibration.intercept() == pytest.approx(1)
@@ -0,0 +1,76 @@
+import json
+import os
+import stat
+import time
+
+import pytest
+
+from StatesManager import write_json_atomic
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_write_json_atomic(tmp_path):
+    path = tmp_path / "data.json"
+    write_json_atomic(str(path), {"a": 1})
+    assert json.loads(path.read_text()) == {"a": 1}
+    # no temp file left behind
+    assert os.listdir(tmp_path) == ["data.json"]
+
+
+def test_write_json_atomic_keeps_the_file_mode(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text("{}")
+    os.chmod(path, 0o644)
+    write_json_atomic(str(path), {"a": 1})
+    assert mode(path) == 0o644
+
+
+def test_write_json_atomic_new_file_follows_umask(tmp_path):
+    umask = os.umask(0o022)
+    try:
+        path = tmp_path / "data.json"
+        write_json_atomic(str(path), {})
+    finally:
+        os.umask(umask)
+    assert mode(path) == 0o644
+
+
+def read_sec_per_liter(states):
+    with open(states.states_file_path, encoding="utf-8") as f:
+        return json.load(f)["sec_per_liter"]
+
+
+@pytest.fixture
+def write_behind(states):
+    states.enable_write_behind(0.05)
+    yield states
+    states.flush()
+    states.write_behind = False
+
+
+def test_setter_writes_right_away_without_write_behind(states):
+    states.set_sec_per_liter(77)
+    assert read_sec_per_liter(states) == 77
+
+
+def test_write_behind_debounces(write_behind):
+    states = write_behind
+    before = read_sec_per_liter(states)
+    states.set_sec_per_liter(70)
+    states.set_sec_per_liter(71)
+    # the value is there right away, the file follows once the debounce window is over
+    assert states.get_sec_per_liter() == 71
+    assert read_sec_per_liter(states) == before
+    time.sleep(0.3)
+    assert read_sec_per_liter(states) == 71
+
+
+def test_flush_writes_pending_changes(write_behind):
+    states = write_behind
+    states.set_sec_per_liter(72)
+    states.flush()
+    assert read_sec_per_liter(states) == 72
+    assert states.flush_timer is None
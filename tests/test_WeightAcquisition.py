@@ -0,0 +1,70 @@
+import threading
+
+from HX711_2 import HX711TimeoutError
+from WeightAcquisition import WeightAcquisition
+
+
+class FakePool:
+    def __init__(self, weights, failing=()):
+        self.lock = threading.Lock()
+        self.weights = weights
+        self.failing = set(failing)
+        self.selected = None
+        self.reads = []
+
+    def select(self, module):
+        self.selected = module
+
+    def read_raw(self, module, times, tolerance=None, min_samples=3):
+        self.reads.append(module)
+        if module in self.failing:
+            raise HX711TimeoutError("unplugged")
+        return [self.weights[module]] * times
+
+    def filtered_weight(self, module, values):
+        return values[-1]
+
+    def standard_error(self, module, values):
+        return 0.0
+
+
+def test_refresh_returns_the_cells_that_answered():
+    pool = FakePool({0: 10, 1: 20, 2: 30}, failing={1})
+    acquisition = WeightAcquisition(pool)
+    assert acquisition.refresh([0, 1, 2]) == {0: 10, 2: 30}
+    assert acquisition.quality[0] == (0.0, 3)
+
+
+def test_samples_are_handed_out_once_the_bus_is_released():
+    pool = FakePool({0: 10, 1: 20})
+    held = []
+
+    def on_sample(module, weight, timestamp):
+        free = pool.lock.acquire(blocking=False)
+        if free:
+            pool.lock.release()
+        held.append((module, weight, not free))
+
+    WeightAcquisition(pool, on_sample).refresh([0, 1])
+    assert held == [(0, 10, False), (1, 20, False)]
+
+
+def test_failing_cell_is_skipped_until_retry_period():
+    pool = FakePool({0: 10, 1: 20}, failing={1})
+    acquisition = WeightAcquisition(pool, retry_period=60)
+    acquisition.refresh([0, 1])
+    pool.reads.clear()
+
+    acquisition.refresh([0, 1])
+    assert pool.reads == [0]
+    acquisition.refresh([0, 1], retry_failed=True)
+    assert pool.reads == [0, 0, 1]
+
+
+def test_max_age_skips_fresh_cells():
+    pool = FakePool({0: 10, 1: 20})
+    acquisition = WeightAcquisition(pool)
+    acquisition.refresh([0])
+    pool.reads.clear()
+    assert acquisition.refresh([0, 1], max_age=60) == {1: 20}
+    assert pool.reads == [1]
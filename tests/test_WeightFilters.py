@@ -0,0 +1,82 @@
+import math
+
+import pytest
+
+from WeightFilters import (EFilter, EmaFilter, KalmanFilter, OutlierRejector, PassThroughFilter, RunningMedianFilter,
+                           make_filter, median_standard_error)
+
+
+def feed(f, samples):
+    for sample in samples:
+        value = f.update(sample)
+    return value
+
+
+def test_running_median_window():
+    f = RunningMedianFilter(3)
+    assert feed(f, [10, 500, 12]) == 12
+    # 10 and 500 left the window
+    assert feed(f, [14, 16]) == 14
+    assert f.sorted == [12, 14, 16]
+
+
+def test_median_standard_error_ignores_one_glitch():
+    steady = [100.0, 100.2, 99.8, 100.1, 99.9]
+    assert median_standard_error(steady + [900.0]) < 0.5
+    assert median_standard_error([100.0]) == math.inf
+
+
+def test_single_glitch_is_rejected():
+    f = OutlierRejector(PassThroughFilter(), threshold=50, max_rejects=3)
+    feed(f, [100, 101])
+    assert f.update(900) == 101
+    assert f.update(102) == 102
+    assert f.rejected == 0
+    assert f.rejected_total == 1
+
+
+def test_real_change_is_followed_after_max_rejects():
+    f = OutlierRejector(RunningMedianFilter(5), threshold=50, max_rejects=3)
+    feed(f, [100, 100, 100, 100, 100])
+    assert f.update(400) == 100
+    assert f.update(400) == 100
+    # third one in a row : the bottle really changed, the old samples must not hold the median back
+    assert f.update(400) == 400
+    assert list(f.filter.samples) == [400]
+    assert f.rejected == 0
+    assert f.rejected_total == 3
+
+
+def test_threshold_zero_disables_rejection():
+    f = OutlierRejector(PassThroughFilter(), threshold=0)
+    feed(f, [100])
+    assert f.update(900) == 900
+    assert f.rejected_total == 0
+
+
+def test_reset_forgets_the_estimate():
+    f = OutlierRejector(EmaFilter(0.5), threshold=50)
+    feed(f, [100, 100, 900])
+    f.reset()
+    assert f.value is None
+    assert f.rejected == 0
+    # nothing to compare against, the first sample is taken as is
+    assert f.update(900) == 900
+
+
+@pytest.mark.parametrize("kind, inner", [
+    (EFilter.NONE, PassThroughFilter),
+    (EFilter.MEDIAN, RunningMedianFilter),
+    (EFilter.EMA, EmaFilter),
+    (EFilter.KALMAN, KalmanFilter),
+])
+def test_make_filter(kind, inner):
+    f = make_filter(kind, outlier_threshold=20, outlier_max_rejects=2)
+    assert isinstance(f, OutlierRejector)
+    assert isinstance(f.filter, inner)
+    assert (f.threshold, f.max_rejects) == (20, 2)
+
+
+def test_make_filter_unknown_kind():
+    with pytest.raises(ValueError):
+        make_filter("average")
@@ -0,0 +1,94 @@
+import pytest
+
+from ZeroTracker import ZeroTracker
+
+
+class FakeController:
+    nb_modules = 2
+
+
+@pytest.fixture
+def tracker(states):
+    for module in range(2):
+        states.set_weight_cell_offset(module, 1000)
+        states.set_weight_cell_reference_unit(module, 100)
+    return ZeroTracker(FakeController(), stable_time=5, band=0.5, max_drift=5.0, max_step=0.5)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def settle(self, tracker, module, weight, jitter=0.0):
+        # one sample a second for a whole stable window
+        for i in range(6):
+            tracker.on_sample(module, (self.now, weight + (jitter if i % 2 else 0.0)))
+            self.now += 1.0
+
+
+def test_empty_cell_is_pulled_back_to_zero(tracker, states):
+    clock = Clock()
+    clock.settle(tracker, 0, 2.0)
+    # a step is capped at max_step grams, i.e. 0.5 * reference_unit on the offset
+    assert states.get_weight_cell_offset(0) == 1050
+    assert tracker.drifts[0] == 0.5
+    assert tracker.references[0] == 0.0
+    assert states.get_weight_cell_offset(1) == 1000
+
+
+def test_bottle_weight_becomes_the_reference(tracker, states):
+    clock = Clock()
+    clock.settle(tracker, 0, 300.0)
+    assert tracker.references[0] == 300.0
+    assert states.get_weight_cell_offset(0) == 1000
+
+    clock.settle(tracker, 0, 300.3)
+    assert states.get_weight_cell_offset(0) == 1030
+    assert tracker.drifts[0] == pytest.approx(0.3)
+
+
+def test_unstable_cell_is_not_corrected(tracker, states):
+    clock = Clock()
+    clock.settle(tracker, 0, 2.0, jitter=1.0)
+    assert tracker.references[0] is None
+    assert states.get_weight_cell_offset(0) == 1000
+
+
+def test_small_drift_is_ignored(tracker, states):
+    clock = Clock()
+    clock.settle(tracker, 0, 0.1)
+    assert states.get_weight_cell_offset(0) == 1000
+    assert tracker.drifts[0] == 0.0
+
+
+def test_large_change_moves_the_reference(tracker, states):
+    clock = Clock()
+    clock.settle(tracker, 0, 300.0)
+    # bottle swapped : not a drift
+    clock.settle(tracker, 0, 250.0)
+    assert tracker.references[0] == 250.0
+    assert states.get_weight_cell_offset(0) == 1000
+
+
+def test_invalidate_takes_a_new_reference(tracker, states):
+    clock = Clock()
+    clock.settle(tracker, 0, 300.0)
+    tracker.invalidate(0)
+    # poured 3 g, within max_drift but a real change
+    clock.settle(tracker, 0, 297.0)
+    assert tracker.references[0] == 297.0
+    assert states.get_weight_cell_offset(0) == 1000
+
+
+def test_status_and_reset_drift(tracker):
+    clock = Clock()
+    clock.settle(tracker, 1, -1.0)
+    status = tracker.get_status()
+    assert status["1"]["drift"] == -0.5
+    assert status["1"]["history"] == [{"timestamp": 5.0, "step": -0.5, "drift": -0.5}]
+
+    tracker.reset_drift(1)
+    status = tracker.get_status()
+    assert status["1"]["drift"] == 0.0
+    assert status["1"]["reference"] is None
+    assert len(status["1"]["history"]) == 1